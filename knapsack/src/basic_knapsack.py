@@ -8,14 +8,32 @@ To run, use the following command:
 
 The flag --print-stack will print the calls to solve_knapsack:
   python3 basic_knapsack.py --print-stack
+
+The flag --engine=dp solves the examples with the exact dp engine:
+  python3 basic_knapsack.py --engine=dp
 '''
 
+import array
+import bisect
+import math
 import sys
 
+try:
+  import numpy as np
+except ImportError:
+  np = None
+
 
 PRINT_LOOP = False
 PRINT_STACK = False
 
+# Max bytes of bitsets kept to rebuild the dp selection.  Above this the
+# items are split in two, so memory stays bounded for large capacities
+DP_MAX_KEEP_BYTES = 1 << 26
+
+# Max items for the mitm engine, which may list 2^(n/2) subsets of each half
+MITM_MAX_ITEMS = 50
+
 
 def find_replace_items(new_items, selected_items, capacity):
   # Need to find items that can be replaced by new_items
@@ -174,37 +192,744 @@ def solve_knapsack(n, items, capacity):
   return [(selected, remaining)]
 
 
-def validate_and_solve_knapsack(items, capacity):
-  '''validate_and_solve_knapsack
-     validates parameters and calls solve_knapsack
+def dp_best(items, capacity, keep=None, start=None):
+  '''dp_best
 
-     items is a list of tuples containing: name, value, w1, w2, ...
-     capacity is a list of capacities: c1, c2, ...
-       The sum of w1 for selected items may not exceed c1
-       Similarly, sum of w2 for selected items may not exceed c2, ...
+     items is a list of tuples containing: name, value, weight
+     capacity is the max total weight
 
-     returns tuple of selected items and value with remaining capacity
+     returns best, where best[c] is the max value of items that
+     weigh at most c in total, for c from 0 to capacity
+     If keep is a list, a bitset is added to it for each item, with bit c
+     set if the item is taken for capacity c
+     If start is given, it is the best of items before these, and best
+     goes on from it, start itself is not changed
   '''
-  if type(capacity).__name__ != 'int' or capacity <= 0:
-    return ([], ['capacity must be a positive integer'])
+  if np is not None:
+    if start is None:
+      best = np.zeros(capacity + 1, dtype=np.int64)
+    else:
+      best = start.copy()
+    for item in items:
+      value, weight = item[1], item[2]
+      take = np.zeros(capacity + 1, dtype=bool)
+      if weight == 0:
+        best += value
+        take[:] = True
+      else:
+        # best[:-weight] is read before best[weight:] is updated,
+        # so each item is taken at most once
+        add = best[:-weight] + value
+        take[weight:] = add > best[weight:]
+        np.maximum(best[weight:], add, out=best[weight:])
+      if keep is not None:
+        keep.append(np.packbits(take, bitorder='little'))
+    return best
+
+  best = [0] * (capacity + 1) if start is None else list(start)
+  for item in items:
+    value, weight = item[1], item[2]
+    bitset = 0
+    for c in range(capacity, weight - 1, -1):
+      if best[c - weight] + value > best[c]:
+        best[c] = best[c - weight] + value
+        bitset |= 1 << c
+    if keep is not None:
+      keep.append(bitset)
+  return best
+
+
+def keep_bit(bitset, c):
+  if isinstance(bitset, int):
+    return (bitset >> c) & 1
+  return (int(bitset[c >> 3]) >> (c & 7)) & 1
+
+
+def best_split(first, second):
+  '''best_split
+
+     first and second are best values of two sets of items for each
+     capacity from 0 to the same capacity
 
+     returns (c, value) for the first c where first[c] plus second at
+     the capacity left is the most
+  '''
+  if np is not None:
+    total = first + second[::-1]
+    c = int(np.argmax(total))
+    return c, total[c]
+  split, best = 0, None
+  for c, (a, b) in enumerate(zip(first, reversed(second))):
+    if best is None or a + b > best:
+      split, best = c, a + b
+  return split, best
+
+
+def best_steps(best):
+  '''best_steps
+
+     returns (capacities, values) for each row of best, with the first
+     capacity and each one where the best value goes up, and the values
+     there.  The rows of best values only go up, so these are all that
+     best_steps_split needs of them, and they are usually far fewer
+  '''
+  if np is not None:
+    steps = []
+    for row in best:
+      capacities = np.concatenate(([0], np.flatnonzero(np.diff(row)) + 1))
+      steps.append((capacities, row[capacities].astype(np.int64)))
+    return steps
+  return [([c for c in range(len(row)) if c == 0 or row[c] != row[c - 1]],
+           [v for c, v in enumerate(row) if c == 0 or v != row[c - 1]])
+          for row in best]
+
+
+def best_steps_split(first, second, capacity):
+  '''best_steps_split
+
+     As best_split, for best values of two sets of items as steps from
+     best_steps.  The first set is given capacity c at one of its steps,
+     as any capacity up to its next step adds no value to the first set
+     and leaves less for the second
+  '''
+  if np is not None:
+    left = np.searchsorted(second[0], capacity - first[0], side='right') - 1
+    total = first[1] + second[1][left]
+    i = int(np.argmax(total))
+    return int(first[0][i]), total[i]
+  split, best = 0, None
+  for c, a in zip(*first):
+    b = second[1][bisect.bisect_right(second[0], capacity - c) - 1]
+    if best is None or a + b > best:
+      split, best = c, a + b
+  return split, best
+
+
+def dp_select(items, capacity):
+  '''dp_select
+
+     returns the items of a max value selection with total weight at
+     most capacity
+
+     If the bitsets for all items would take more than DP_MAX_KEEP_BYTES,
+     the items are split in two halves, the capacity is split where the
+     best values of the halves add up to the most, and each half is
+     solved on its own
+  '''
   if not items:
-    return ([], ['must have at least one item'])
+    return []
+  if len(items) == 1 or len(items) * (capacity + 1) <= 8 * DP_MAX_KEEP_BYTES:
+    keep = []
+    dp_best(items, capacity, keep)
+    selected = []
+    c = capacity
+    for i in range(len(items) - 1, -1, -1):
+      if keep_bit(keep[i], c):
+        selected.append(items[i])
+        c -= items[i][2]
+    return selected
+
+  half = len(items) // 2
+  first = dp_best(items[:half], capacity)
+  second = dp_best(items[half:], capacity)
+  split, value = best_split(first, second)
+  del first, second
+  return (dp_select(items[:half], split) +
+          dp_select(items[half:], capacity - split))
+
+
+def dp_walk(items, capacity, targets, keep=None):
+  '''dp_walk
+
+     Walks back over the dp of items from each capacity in targets, all
+     at most capacity, as dp_select does from one, all at once
+
+     keep is the bitsets of all the items from dp_best, if they were kept.
+     Otherwise they are kept for a window of items at a time, at most
+     DP_MAX_KEEP_BYTES, last window first.  The best values at the start
+     of a window are found by dp from the start of a range of items twice
+     its length, which is found the same way, so only O(log(items)) best
+     arrays are kept, and it takes O(log(items)) dp passes
+
+     returns a list with the indexes of the items taken for each target
+  '''
+  if np is not None:
+    c = np.array(targets, dtype=np.int64)
+    taken = np.zeros((len(items), len(targets)), dtype=bool)
+  else:
+    c = list(targets)
+    taken = [[] for t in targets]
+
+  def back(lo, bitsets):
+    for i in range(lo + len(bitsets) - 1, lo - 1, -1):
+      bitset = bitsets[i - lo]
+      if np is not None:
+        taken[i] = (bitset[c >> 3] >> (c & 7)) & 1
+        np.subtract(c, taken[i] * items[i][2], out=c)
+        continue
+      for j in range(len(c)):
+        if keep_bit(bitset, c[j]):
+          taken[j].append(i)
+          c[j] -= items[i][2]
+
+  window = max(1, 8 * DP_MAX_KEEP_BYTES // (capacity + 1))
+
+  def walk(lo, hi, best):
+    if hi - lo <= window:
+      bitsets = []
+      dp_best(items[lo:hi], capacity, bitsets, best)
+      back(lo, bitsets)
+      return
+    mid = (lo + hi) // 2
+    walk(mid, hi, dp_best(items[lo:mid], capacity, start=best))
+    walk(lo, mid, best)
+
+  if keep is not None:
+    back(0, keep)
+  elif items:
+    walk(0, len(items), None)
+  if np is not None:
+    return [np.flatnonzero(taken[:, j]).tolist() for j in range(len(targets))]
+  return [sorted(t) for t in taken]
+
+
+def dp_best_count(items, capacity, count, keep=None):
+  '''dp_best_count
+
+     As dp_best, with at most count items taken
+
+     returns best, where best[k][c] is the max value of at most k items
+     that weigh at most c in total.  Each bitset added to keep has bit
+     (k - 1) * (capacity + 1) + c set if the item is taken as one of at
+     most k items for capacity c
+  '''
+  if np is not None:
+    size = capacity + 1
+    # The table has a row per count, so int32 halves it when it can
+    dtype = np.int32 if sum([i[1] for i in items]) < 1 << 31 else np.int64
+    best = np.zeros((count + 1, size), dtype=dtype)
+    # One row of sums and the take bits are reused for every item, and
+    # the rows of best are updated in place
+    add = np.empty(size, dtype=dtype)
+    take = np.zeros((count, size), dtype=bool) if keep is not None else None
+    for item in items:
+      value, weight = item[1], item[2]
+      if weight > capacity:
+        if keep is not None:
+          take[:] = False
+      else:
+        if keep is not None:
+          take[:, :weight] = False
+        # Row k - 1 is read before it is updated, as in dp_best
+        for k in range(count, 0, -1):
+          row = best[k, weight:]
+          np.add(best[k - 1, :size - weight], value, out=add[:size - weight])
+          if keep is not None:
+            np.greater(add[:size - weight], row, out=take[k - 1, weight:])
+          np.maximum(row, add[:size - weight], out=row)
+      if keep is not None:
+        keep.append(np.packbits(take, bitorder='little'))
+    return best
+
+  best = [[0] * (capacity + 1) for k in range(count + 1)]
+  for item in items:
+    value, weight = item[1], item[2]
+    bitset = 0
+    for k in range(count, 0, -1):
+      row, prev = best[k], best[k - 1]
+      for c in range(capacity, weight - 1, -1):
+        if prev[c - weight] + value > row[c]:
+          row[c] = prev[c - weight] + value
+          bitset |= 1 << ((k - 1) * (capacity + 1) + c)
+    if keep is not None:
+      keep.append(bitset)
+  return best
+
+
+def dp_select_count(items, capacity, count):
+  '''dp_select_count
+
+     returns the items of a max value selection of at most count items
+     with total weight at most capacity
+
+     No selection has more items than the lightest ones that fit in
+     capacity, so if count is at least that many the limit never binds
+     and the items are solved by dp_select.  Otherwise, as dp_select,
+     the items are split in two halves if the bitsets would take more
+     than DP_MAX_KEEP_BYTES, splitting both the count and capacity.
+     Each half keeps rows for no more counts than it has items, and the
+     capacity is at most the weight of the count heaviest items
+  '''
+  if not items or count == 0:
+    return []
+  weights = sorted([i[2] for i in items])
+  fit, total = 0, 0
+  while fit < len(weights) and total + weights[fit] <= capacity:
+    total += weights[fit]
+    fit += 1
+  if count >= fit:
+    return dp_select(items, capacity)
+  capacity = min(capacity, sum(weights[-count:]))
+  size = capacity + 1
+  if len(items) == 1 or len(items) * count * size <= 8 * DP_MAX_KEEP_BYTES:
+    keep = []
+    dp_best_count(items, capacity, count, keep)
+    selected = []
+    k, c = count, capacity
+    for i in range(len(items) - 1, -1, -1):
+      if k and keep_bit(keep[i], (k - 1) * size + c):
+        selected.append(items[i])
+        k -= 1
+        c -= items[i][2]
+    return selected
+
+  half = len(items) // 2
+  first_count = min(count, half)
+  second_count = min(count, len(items) - half)
+  # Only the steps of each table are held, so the table of one half is
+  # gone before the other is made
+  first = best_steps(dp_best_count(items[:half], capacity, first_count))
+  second = best_steps(dp_best_count(items[half:], capacity, second_count))
+  # The best split of count and capacity, one count at a time
+  best = None
+  for j in range(count - second_count, first_count + 1):
+    split, value = best_steps_split(first[j], second[count - j], capacity)
+    if best is None or value > best:
+      best, k, c = value, j, split
+  del first, second
+  return (dp_select_count(items[:half], c, k) +
+          dp_select_count(items[half:], capacity - c, count - k))
+
+
+def solve_knapsack_dp(n, items, capacity):
+  '''solve_knapsack_dp
+
+     Exact 0/1 knapsack by dynamic programming over capacity, with one
+     rolling array of best values, vectorized with numpy if it is
+     installed.  Takes O(len(items) * capacity) time.  If n limits the
+     number of items, there is a row of best values for each count up to
+     n, and it takes O(len(items) * n * capacity) time.
+
+     n is max number of items to take
+     items is a list of tuples containing: name, value, weight
+     capacity is the max total weight
+
+     returns a list with one tuple of selected items and value with
+     remaining capacity, as solve_knapsack
+  '''
+  if PRINT_STACK:
+    print(f'Called solve_dp {[i[0] for i in items]} {n} for {capacity}')
+
+  # Exclude items that don't fit
+  items = [i for i in items if i[2] <= capacity]
+  if not items:
+    return [([], ['no items fit'])]
+  if n < 1:
+    return [([], ['no items fit'])]
+
+  # Weights in units of their gcd, and no more capacity than all the
+  # items need, so the dp array is as short as possible
+  unit = math.gcd(*[i[2] for i in items]) or 1
+  scaled = [(i[0], i[1], i[2] // unit) for i in items]
+  size = min(capacity // unit, sum([i[2] for i in scaled]))
+  if n < len(items):
+    selected = dp_select_count(scaled, size, n)
+  else:
+    selected = dp_select(scaled, size)
+
+  names = set([s[0] for s in selected])
+  selected = [i for i in items if i[0] in names]
+  remaining = [sum([i[1] for i in selected]),
+               capacity - sum([i[2] for i in selected])]
+  if PRINT_STACK:
+    print(f'returning {[s[0] for s in selected]} {remaining}')
+  return [([s[0] for s in selected], remaining)]
+
+
+def merge_frontier(weights, values, item, capacity, masks=None, bit=0):
+  '''merge_frontier
+
+     weights and values are the states of a pareto frontier: weights
+     ascending, and values strictly ascending, so no state is dominated
+     by a lighter one with at least its value
+
+     returns the frontier after adding item: the states shifted by the
+     item's weight and value are merged in, and dominated states dropped.
+     If masks are given, one for each state, the shifted states get bit
+     added to theirs and the masks are returned too, otherwise None
+  '''
+  value, weight = item[1], item[2]
+  if np is not None:
+    fit = np.searchsorted(weights, capacity - weight, side='right')
+    w = np.concatenate([weights, weights[:fit] + weight])
+    v = np.concatenate([values, values[:fit] + value])
+    # Both halves are sorted, so the stable sort is a merge of two runs
+    order = np.argsort(w, kind='stable')
+    w, v = w[order], v[order]
+    best = np.maximum.accumulate(v)
+    keep = np.empty(len(v), dtype=bool)
+    keep[0] = True
+    keep[1:] = v[1:] > best[:-1]
+    order, w, v = order[keep], w[keep], v[keep]
+    # Of states of the same weight, only the last has the most value
+    keep = np.empty(len(w), dtype=bool)
+    keep[-1] = True
+    keep[:-1] = w[1:] != w[:-1]
+    if masks is not None:
+      masks = np.concatenate([masks, masks[:fit] | bit])[order[keep]]
+    return w[keep], v[keep], masks
+
+  merged_weights = array.array('q')
+  merged_values = array.array('q')
+  merged_masks = array.array('q')
+  i = j = 0
+  while i < len(weights) or j < len(weights):
+    if j < len(weights) and weights[j] + weight > capacity:
+      j = len(weights)
+    if i < len(weights) and (j >= len(weights) or
+                             weights[i] <= weights[j] + weight):
+      w, v, m = weights[i], values[i], masks[i] if masks else 0
+      i += 1
+    elif j < len(weights):
+      w, v = weights[j] + weight, values[j] + value
+      m = masks[j] | bit if masks else 0
+      j += 1
+    else:
+      break
+    if merged_values and v <= merged_values[-1]:
+      continue
+    if merged_weights and w == merged_weights[-1]:
+      merged_weights.pop()
+      merged_values.pop()
+      merged_masks.pop()
+    merged_weights.append(w)
+    merged_values.append(v)
+    merged_masks.append(m)
+  return merged_weights, merged_values, merged_masks if masks else None
+
+
+def pareto_frontier(items, capacity, track=False):
+  '''pareto_frontier
+
+     returns the (weight, value) states of all selections of items that
+     weigh at most capacity and are not dominated, as two arrays of
+     weights and values, both ascending.  If track is True, also an
+     array of masks, with bit i set if items[i] is in the selection,
+     otherwise None
+  '''
+  if np is not None:
+    weights = np.zeros(1, dtype=np.int64)
+    values = np.zeros(1, dtype=np.int64)
+    masks = np.zeros(1, dtype=np.int64) if track else None
+  else:
+    weights = array.array('q', [0])
+    values = array.array('q', [0])
+    masks = array.array('q', [0]) if track else None
+  for i, item in enumerate(items):
+    if item[2] <= capacity:
+      weights, values, masks = merge_frontier(
+        weights, values, item, capacity, masks, 1 << i)
+  return weights, values, masks
+
+
+def pareto_select(items, capacity):
+  '''pareto_select
+
+     returns the items of a max value selection with total weight at
+     most capacity
+
+     Only frontiers are kept, not the selections that make them.  The
+     items are split in two halves, the best pair of states of their
+     frontiers gives the capacity for each half, and each half is
+     solved for its capacity in turn
+  '''
+  if len(items) == 1:
+    return list(items) if items[0][2] <= capacity else []
+  if not items:
+    return []
+
+  half = len(items) // 2
+  first_weights, first_values, masks = pareto_frontier(items[:half], capacity)
+  second_weights, second_values, masks = pareto_frontier(items[half:], capacity)
+  if np is not None:
+    # Heaviest state of the second half that fits with each of the first
+    j = np.searchsorted(second_weights, capacity - first_weights,
+                        side='right') - 1
+    i = int(np.argmax(first_values + second_values[j]))
+    split = int(first_weights[i])
+  else:
+    best = -1
+    j = len(second_weights) - 1
+    for i in range(len(first_weights)):
+      while first_weights[i] + second_weights[j] > capacity:
+        j -= 1
+      if first_values[i] + second_values[j] > best:
+        best = first_values[i] + second_values[j]
+        split = first_weights[i]
+  del first_weights, first_values, second_weights, second_values
+  return (pareto_select(items[:half], split) +
+          pareto_select(items[half:], capacity - split))
+
+
+def solve_knapsack_pareto(n, items, capacity):
+  '''solve_knapsack_pareto
+
+     Exact 0/1 knapsack keeping only the pareto frontier of (weight,
+     value) states as items are added (Nemhauser-Ullmann).  Time and
+     memory grow with the size of the frontier, not the capacity, so it
+     suits weights and capacities too large for the dp engine.
+
+     n is max number of items to take, it must be at least len(items)
+     items is a list of tuples containing: name, value, weight
+     capacity is the max total weight
+
+     returns a list with one tuple of selected items and value with
+     remaining capacity, as solve_knapsack
+  '''
+  if PRINT_STACK:
+    print(f'Called solve_pareto {[i[0] for i in items]} {n} for {capacity}')
+
+  # Exclude items that don't fit
+  items = [i for i in items if i[2] <= capacity]
+  if not items:
+    return [([], ['no items fit'])]
+  if n < len(items):
+    return [([], ['pareto engine cannot limit the number of items'])]
+
+  selected = pareto_select(items, capacity)
+  remaining = [sum([i[1] for i in selected]),
+               capacity - sum([i[2] for i in selected])]
+  if PRINT_STACK:
+    print(f'returning {[s[0] for s in selected]} {remaining}')
+  return [([s[0] for s in selected], remaining)]
+
+
+def mitm_select(items, capacity):
+  '''mitm_select
+
+     returns the items of a max value selection with total weight at
+     most capacity
+
+     Meet in the middle: the subset sums of each half of the items are
+     listed in order of weight, dropping dominated ones as each item is
+     merged in, see pareto_frontier.  For each subset of the first half,
+     a binary search finds the heaviest subset of the second half that
+     still fits, which is also the one with the most value.
+  '''
+  half = (len(items) + 1) // 2
+  first, second = items[:half], items[half:]
+  first_weights, first_values, first_masks = pareto_frontier(
+    first, capacity, True)
+  weights, values, masks = pareto_frontier(second, capacity, True)
+
+  if np is not None:
+    j = np.searchsorted(weights, capacity - first_weights, side='right') - 1
+    i = int(np.argmax(first_values + values[j]))
+    first_mask, second_mask = int(first_masks[i]), int(masks[j[i]])
+  else:
+    best = -1
+    for i in range(len(first_weights)):
+      j = bisect.bisect_right(weights, capacity - first_weights[i]) - 1
+      if first_values[i] + values[j] > best:
+        best = first_values[i] + values[j]
+        first_mask, second_mask = first_masks[i], masks[j]
+
+  return ([first[i] for i in range(len(first)) if first_mask >> i & 1] +
+          [second[i] for i in range(len(second)) if second_mask >> i & 1])
+
+
+def solve_knapsack_mitm(n, items, capacity):
+  '''solve_knapsack_mitm
+
+     Exact 0/1 knapsack by meet in the middle, for up to MITM_MAX_ITEMS
+     items with any capacity.  Takes O(2^(n/2) * n) time and memory.
+
+     n is max number of items to take, it must be at least len(items)
+     items is a list of tuples containing: name, value, weight
+     capacity is the max total weight
+
+     returns a list with one tuple of selected items and value with
+     remaining capacity, as solve_knapsack
+  '''
+  if PRINT_STACK:
+    print(f'Called solve_mitm {[i[0] for i in items]} {n} for {capacity}')
+
+  # Exclude items that don't fit
+  items = [i for i in items if i[2] <= capacity]
+  if not items:
+    return [([], ['no items fit'])]
+  if n < len(items):
+    return [([], ['mitm engine cannot limit the number of items'])]
+  if len(items) > MITM_MAX_ITEMS:
+    return [([], [f'mitm engine takes at most {MITM_MAX_ITEMS} items'])]
+
+  selected = mitm_select(items, capacity)
+  remaining = [sum([i[1] for i in selected]),
+               capacity - sum([i[2] for i in selected])]
+  if PRINT_STACK:
+    print(f'returning {[s[0] for s in selected]} {remaining}')
+  return [([s[0] for s in selected], remaining)]
+
+
+# Ways to solve, each called as solve_knapsack(n, items, capacity)
+ENGINES = {
+  'heuristic': solve_knapsack,
+  'dp': solve_knapsack_dp,
+  'pareto': solve_knapsack_pareto,
+  'mitm': solve_knapsack_mitm,
+}
+
+
+def validate_items(items):
+  '''validate_items
+
+     returns a list with the error message if items are not valid,
+     otherwise None
+  '''
+  if not items:
+    return ['must have at least one item']
   if len(set([i[0] for i in items])) != len(items):
-    return ([], ['item names are not unique'])
+    return ['item names are not unique']
   item_length = [len(i) for i in items]
   if (min(item_length) != 3) or (max(item_length) != 3):
-    return ([], ['items must have name, value and weight'])
+    return ['items must have name, value and weight']
   for item in items:
     item_type = list(set([type(i).__name__ for i in item[1:]]))
     if len(item_type) != 1 or item_type[0] != 'int':
-      return ([], ['all item values and weights must be int'])
+      return ['all item values and weights must be int']
   if min([i[1] for i in items]) <= 0:
-    return ([], ['all item values must be > 0'])
+    return ['all item values must be > 0']
   if min([i[2] for i in items]) < 0:
-    return ([], ['all item weights must be >= 0'])
+    return ['all item weights must be >= 0']
+  return None
+
+
+class Catalog:
+  '''Catalog
+
+     Items prepared to be packed for many capacities
+
+     The items are validated once, and one dp pass up to the largest
+     capacity asked for answers every capacity up to it: the bitsets kept
+     for each item rebuild the selection for any capacity.  The pass is
+     kept, so later calls for capacities no larger are answered without
+     solving again.  If the bitsets would take more than
+     DP_MAX_KEEP_BYTES, they are not kept, and each call walks back over
+     the dp for all its capacities at once with dp_walk instead.
+
+     items is a list of tuples containing: name, value, weight
+  '''
+
+  def __init__(self, items):
+    self.items = items
+    self.error = validate_items(items)
+    self.keep = None
+    self.size = -1
+    if not self.error:
+      # Weights in units of their gcd, as in solve_knapsack_dp
+      self.unit = math.gcd(*[i[2] for i in items]) or 1
+      self.scaled = [(i[0], i[1], i[2] // self.unit) for i in items]
+      self.total = sum([i[2] for i in self.scaled])
+
+  def prepare(self, capacity):
+    size = min(capacity // self.unit, self.total)
+    if size > self.size:
+      self.keep = None
+      self.size = -1
+      if len(self.items) * (size + 1) <= 8 * DP_MAX_KEEP_BYTES:
+        if PRINT_STACK:
+          print(f'Called catalog dp {[i[0] for i in self.items]} '
+                f'for {capacity}')
+        self.keep = []
+        dp_best(self.scaled, size, self.keep)
+        self.size = size
+
+  def select(self, capacities):
+    '''select
+
+       returns a list with a tuple of selected items and value with
+       remaining capacity for each capacity, once prepared for them
+
+       With the bitsets kept, the capacities are walked back over the
+       items a chunk at a time, so the items taken for a chunk fit in
+       DP_MAX_KEEP_BYTES.  Without them, each walk repeats the dp, so all
+       the capacities are walked at once
+    '''
+    results = []
+    chunk = len(capacities)
+    if self.keep is not None:
+      chunk = max(1, DP_MAX_KEEP_BYTES // len(self.items))
+    for start in range(0, len(capacities), chunk):
+      part = capacities[start:start + chunk]
+      targets = [min(c // self.unit, self.total) for c in part]
+      for capacity, taken in zip(part, dp_walk(
+          self.scaled, max(targets), targets, self.keep)):
+        results.append(self.selection(
+          [self.items[i] for i in taken], capacity))
+    return results
+
+  def selection(self, selected, capacity):
+    if not selected:
+      return ([], ['no items fit'])
+    return (sorted([s[0] for s in selected]),
+            [sum([s[1] for s in selected]),
+             capacity - sum([s[2] for s in selected])])
+
+  def solve(self, capacities):
+    '''solve
+
+       capacities is a list of capacities, each a positive int
+
+       returns a list with a tuple of selected items and value with
+       remaining capacity for each capacity, in the same order
+    '''
+    if self.error:
+      return [([], self.error) for c in capacities]
+
+    def valid(c):
+      return type(c).__name__ == 'int' and c > 0
+
+    ok = [c for c in capacities if valid(c)]
+    self.prepare(max(ok or [0]))
+    solved = iter(self.select(ok))
+    return [next(solved) if valid(c)
+            else ([], ['capacity must be a positive integer'])
+            for c in capacities]
+
+  def solve_up_to(self, max_capacity):
+    '''solve for every capacity from 1 to max_capacity'''
+    return self.solve(list(range(1, max_capacity + 1)))
+
+
+def validate_and_solve_knapsack(items, capacity, engine='heuristic',
+                                max_items=None):
+  '''validate_and_solve_knapsack
+     validates parameters and calls solve_knapsack
+
+     items is a list of tuples containing: name, value, w1, w2, ...
+     capacity is a list of capacities: c1, c2, ...
+       The sum of w1 for selected items may not exceed c1
+       Similarly, sum of w2 for selected items may not exceed c2, ...
+
+     engine is a name from ENGINES, dp gives the exact max value
+     max_items is the max number of items to take, default is no limit
+
+     returns tuple of selected items and value with remaining capacity
+  '''
+  if engine not in ENGINES:
+    return ([], [f'unknown engine {engine}, use one of {sorted(ENGINES)}'])
+  if max_items is not None and (
+      type(max_items).__name__ != 'int' or max_items <= 0):
+    return ([], ['max_items must be a positive integer'])
+  if type(capacity).__name__ != 'int' or capacity <= 0:
+    return ([], ['capacity must be a positive integer'])
+
+  error = validate_items(items)
+  if error:
+    return ([], error)
 
-  solve = solve_knapsack(len(items), items, capacity)
+  n = len(items) if max_items is None else min(max_items, len(items))
+  solve = ENGINES[engine](n, items, capacity)
   ordered_items = sorted([s for s in solve if s[0]], key=lambda x:-x[1][0])
   return ordered_items[0] if ordered_items else solve[0]
 
@@ -219,24 +944,28 @@ if __name__ == '__main__':
     PRINT_LOOP = True
   if '--print-stack' in sys.argv:
     PRINT_STACK = True
+  engine = 'heuristic'
+  for arg in sys.argv:
+    if arg.startswith('--engine='):
+      engine = arg.split('=', 1)[1]
 
   print(print_knapsack(validate_and_solve_knapsack(
-    [('A', 1, 1), ('A', 6, 2), ('C', 10, 3), ('D', 16, 5)], 7)))
+    [('A', 1, 1), ('A', 6, 2), ('C', 10, 3), ('D', 16, 5)], 7, engine)))
   print(print_knapsack(validate_and_solve_knapsack(
-    [('A', 10, 10), ('B', 11, 11), ('C', 12, 12)], 30)))
+    [('A', 10, 10), ('B', 11, 11), ('C', 12, 12)], 30, engine)))
   print(print_knapsack(validate_and_solve_knapsack(
-    [('A', 10, 10), ('B', 11, 11), ('C', 12, 12)], 33)))
+    [('A', 10, 10), ('B', 11, 11), ('C', 12, 12)], 33, engine)))
   print(print_knapsack(validate_and_solve_knapsack(
-    [('A', 20, 15), ('B', 13, 8), ('C', 11, 8), ('D', 5, 5)], 20)))
+    [('A', 20, 15), ('B', 13, 8), ('C', 11, 8), ('D', 5, 5)], 20, engine)))
   print(print_knapsack(validate_and_solve_knapsack(
-    [('A', 11, 8), ('B', 13, 8), ('C', 20, 15), ('D', 5, 5)], 20)))
+    [('A', 11, 8), ('B', 13, 8), ('C', 20, 15), ('D', 5, 5)], 20, engine)))
   print(print_knapsack(validate_and_solve_knapsack(
-    [('A', 3, 3), ('B', 5, 5), ('C', 3, 3)], 6)))
+    [('A', 3, 3), ('B', 5, 5), ('C', 3, 3)], 6, engine)))
   print(print_knapsack(validate_and_solve_knapsack(
-    [('A', 1, 1), ('B', 6, 2), ('C', 10, 3), ('D', 16, 5)], 7)))
+    [('A', 1, 1), ('B', 6, 2), ('C', 10, 3), ('D', 16, 5)], 7, engine)))
   print(print_knapsack(validate_and_solve_knapsack(
-    [('A', 1, 1), ('B', 6, 2), ('C', 10, 3), ('D', 16, 5)], 6)))
+    [('A', 1, 1), ('B', 6, 2), ('C', 10, 3), ('D', 16, 5)], 6, engine)))
   print(print_knapsack(validate_and_solve_knapsack(
-    [('A', 1, 3), ('B', 6, 2), ('C', 10, 5), ('D', 16, 4)], 7)))
+    [('A', 1, 3), ('B', 6, 2), ('C', 10, 5), ('D', 16, 4)], 7, engine)))
 
 
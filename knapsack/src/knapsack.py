@@ -8,13 +8,27 @@ To run, use the following command:
 
 The flag --print-stack will print the calls to solve_knapsack:
   python3 knapsack.py --print-stack
+
+The flag --engine=mitm solves the examples with one weight exactly:
+  python3 knapsack.py --engine=mitm
+
+The flag --engine=bb solves them exactly by branch and bound, and
+--print-bound prints the incumbent and bound as they improve:
+  python3 knapsack.py --engine=bb --print-bound
 '''
 
+import bisect
 import sys
 
+import basic_knapsack
+
 
 PRINT_LOOP = False
 PRINT_STACK = False
+PRINT_BOUND = False
+
+# Max nodes for the bb engine, after that it returns the best found
+BB_MAX_NODES = 1000000
 
 
 def check_fit(item, remaining):
@@ -125,7 +139,223 @@ def solve_knapsack(items, capacity):
   return (selected, remaining)
 
 
-def validate_and_solve_knapsack(items, capacity):
+def solve_knapsack_mitm(items, capacity):
+  '''solve_knapsack_mitm
+
+     Exact solve by meet in the middle, for one weight only,
+     see basic_knapsack.solve_knapsack_mitm
+
+     returns tuple of selected items and value with remaining capacity
+  '''
+  if len(capacity) != 1:
+    return ([], ['mitm engine takes one weight'])
+  # basic_knapsack prints as this module does, until it returns
+  print_stack = basic_knapsack.PRINT_STACK
+  basic_knapsack.PRINT_STACK = PRINT_STACK
+  try:
+    return basic_knapsack.solve_knapsack_mitm(
+      len(items), items, capacity[0])[0]
+  finally:
+    basic_knapsack.PRINT_STACK = print_stack
+
+
+def lagrangian_bound(items, capacity, rounds=200):
+  '''lagrangian_bound
+
+     Upper bound on the value by Lagrangian relaxation: with a multiplier
+     per capacity, each item is taken if its value is more than the sum
+     of multiplier * weight, and the bound is the sum of those reduced
+     values plus multiplier * capacity.  The multipliers are improved by
+     subgradient steps, and the best converge to the LP relaxation bound.
+
+     returns the bound, and the multipliers
+  '''
+  dims = len(capacity)
+  weight = sum([sum(i[2:]) for i in items])
+  start = sum([i[1] for i in items]) / weight if weight else 0
+  multipliers = [start] * dims
+  best = None
+  best_multipliers = multipliers
+  step = 2.0
+  stall = 0
+  for k in range(rounds):
+    bound = sum([m * c for m, c in zip(multipliers, capacity)])
+    slack = list(capacity)
+    for item in items:
+      reduced = item[1] - sum([m * w for m, w in zip(multipliers, item[2:])])
+      if reduced > 0:
+        bound += reduced
+        for c in range(dims):
+          slack[c] -= item[2 + c]
+    if best is None or bound < best:
+      best, best_multipliers = bound, multipliers
+      stall = 0
+    else:
+      stall += 1
+      if stall >= 10:
+        step /= 2
+        stall = 0
+    norm = sum([s * s for s in slack])
+    if norm == 0 or step < 1e-6:
+      break
+    size = step * max(bound - 0.95 * best, 0.01 * best) / norm
+    multipliers = [max(0, m - size * s) for m, s in zip(multipliers, slack)]
+  return best, best_multipliers
+
+
+def branch_and_bound(items, capacity, max_nodes=None):
+  '''branch_and_bound
+
+     Exact multi-dimensional knapsack by depth first branch and bound
+
+     The multipliers of lagrangian_bound combine the weights of each item
+     into one surrogate weight, and likewise the capacities.  Any
+     selection that fits capacity fits the surrogate capacity, so the
+     fractional (LP) solution of that one weight knapsack bounds the
+     value.  Items are branched on in order of value per surrogate
+     weight, taking the item first, so the items left at a node are the
+     tail of that order and its bound is a binary search in prefix sums.
+
+     The incumbent starts as the greedy fill in that order, and is the
+     best node so far, as every node is a selection that fits.  Nodes
+     whose bound is no better are pruned.  Before the search, items
+     whose reduced value is so far from 0 that the other choice would
+     bound below the incumbent are fixed to in or out.
+
+     items is a list of tuples containing: name, value, w1, w2, ...
+     capacity is a list of capacities: c1, c2, ...
+     max_nodes stops the search early, default is no limit
+
+     returns a dict with the selected items, remaining (value and
+     remaining capacity, as solve_knapsack), the upper bound on the
+     value, the number of nodes, and whether the value is proven optimal
+  '''
+  items = [i for i in items if check_fit(i[2:], capacity)]
+  dims = len(capacity)
+  lagrangian, multipliers = lagrangian_bound(items, capacity)
+  weights = [sum([m * w for m, w in zip(multipliers, i[2:])]) for i in items]
+  order = sorted(range(len(items)), key=lambda i: (
+    -items[i][1] / weights[i] if weights[i] > 0 else float('-inf')))
+  items = [items[i] for i in order]
+  weights = [weights[i] for i in order]
+
+  best = []
+  remaining = list(capacity)
+  for item in items:
+    if check_fit(item[2:], remaining):
+      best.append(item)
+      remaining = [remaining[c] - item[2 + c] for c in range(dims)]
+  best_value = sum([i[1] for i in best])
+  if PRINT_BOUND:
+    print(f'incumbent {best_value} bound {lagrangian:.1f} greedy')
+
+  # Values are int, so a better selection has at least best_value + 1
+  eps = 1e-9
+  fixed = []
+  free = []
+  for i, item in enumerate(items):
+    reduced = item[1] - weights[i]
+    if lagrangian - abs(reduced) < best_value + 1 - eps:
+      if reduced > 0:
+        fixed.append(item)
+    else:
+      free.append(i)
+  base = sum([i[1] for i in fixed])
+  start = list(capacity)
+  for item in fixed:
+    start = [start[c] - item[2 + c] for c in range(dims)]
+  items = [items[i] for i in free]
+  weights = [weights[i] for i in free]
+
+  # prefix_weight[k] and prefix_value[k] are the sums of the first k items
+  prefix_weight = [0]
+  prefix_value = [0]
+  for i, item in enumerate(items):
+    prefix_weight.append(prefix_weight[-1] + weights[i])
+    prefix_value.append(prefix_value[-1] + item[1])
+
+  def bound(k, value, remaining):
+    left = sum([m * r for m, r in zip(multipliers, remaining)])
+    # Items k..b-1 fit whole in the surrogate capacity left
+    b = bisect.bisect_right(prefix_weight, prefix_weight[k] + left, k) - 1
+    total = value + prefix_value[b] - prefix_value[k]
+    if b < len(items) and weights[b] > 0:
+      total += items[b][1] * (
+        left - (prefix_weight[b] - prefix_weight[k])) / weights[b]
+    return total
+
+  stack = []
+  # If the fixed items do not fit, no selection beats the incumbent
+  if all([c >= 0 for c in start]):
+    root = min(lagrangian, bound(0, base, start))
+    stack.append((root, 0, base, tuple(start), None))
+  nodes = 0
+  while stack:
+    if max_nodes is not None and nodes >= max_nodes:
+      break
+    node_bound, k, value, remaining, path = stack.pop()
+    if node_bound < best_value + 1 - eps:
+      continue
+    nodes += 1
+    if value > best_value:
+      best_value = value
+      best = list(fixed)
+      link = path
+      while link:
+        i, link = link
+        best.append(items[i])
+      if PRINT_BOUND:
+        print(f'incumbent {best_value} bound {root:.1f} nodes {nodes}')
+    if k == len(items):
+      continue
+
+    # Push the branch without item k first, so the one with it is next
+    without = bound(k + 1, value, remaining)
+    if without >= best_value + 1 - eps:
+      stack.append((without, k + 1, value, remaining, path))
+    item = items[k]
+    if check_fit(item[2:], remaining):
+      taken = tuple([remaining[c] - item[2 + c] for c in range(dims)])
+      stack.append((node_bound, k + 1, value + item[1], taken, (k, path)))
+
+  optimal = not stack
+  upper = max([best_value] + [s[0] for s in stack])
+  if PRINT_BOUND:
+    print(f'incumbent {best_value} bound {upper:.1f} nodes {nodes}' +
+          (' optimal' if optimal else ''))
+  return {
+    'selected': [i[0] for i in best],
+    'remaining': [best_value] + [
+      capacity[c] - sum([i[2 + c] for i in best]) for c in range(dims)],
+    'bound': upper,
+    'nodes': nodes,
+    'optimal': optimal,
+  }
+
+
+def solve_knapsack_bb(items, capacity):
+  '''solve_knapsack_bb
+
+     Exact solve by branch and bound, see branch_and_bound.  If it takes
+     more than BB_MAX_NODES nodes, the best selection found is returned.
+
+     returns tuple of selected items and value with remaining capacity
+  '''
+  result = branch_and_bound(items, capacity, BB_MAX_NODES)
+  if not result['selected']:
+    return ([], ['no items fit'])
+  return (result['selected'], result['remaining'])
+
+
+# Ways to solve, each called as solve_knapsack(items, capacity)
+ENGINES = {
+  'greedy': solve_knapsack,
+  'mitm': solve_knapsack_mitm,
+  'bb': solve_knapsack_bb,
+}
+
+
+def validate_and_solve_knapsack(items, capacity, engine='greedy'):
   '''validate_and_solve_knapsack
      validates parameters and calls solve_knapsack
 
@@ -134,8 +364,12 @@ def validate_and_solve_knapsack(items, capacity):
        The sum of w1 for selected items may not exceed c1
        Similarly, sum of w2 for selected items may not exceed c2, ...
 
+     engine is a name from ENGINES, mitm is exact but takes one weight
+
      returns tuple of selected items and value with remaining capacity
   '''
+  if engine not in ENGINES:
+    return ([], [f'unknown engine {engine}, use one of {sorted(ENGINES)}'])
   if type(capacity).__name__ not in ['list', 'tuple']:
     return ([], ['capacity must be a list of int'])
   capacity_type = list(set([type(c).__name__ for c in capacity]))
@@ -166,7 +400,7 @@ def validate_and_solve_knapsack(items, capacity):
 
   # Use greedy algorithm - sort by max value and then by least weight
   sorted_items = sorted(items, key=lambda x : (-x[1], sum(x[2:])))
-  return solve_knapsack(sorted_items, capacity)
+  return ENGINES[engine](sorted_items, capacity)
 
 
 def print_knapsack(sack):
@@ -179,26 +413,32 @@ if __name__ == '__main__':
     PRINT_LOOP = True
   if '--print-stack' in sys.argv:
     PRINT_STACK = True
+  if '--print-bound' in sys.argv:
+    PRINT_BOUND = True
+  engine = 'greedy'
+  for arg in sys.argv:
+    if arg.startswith('--engine='):
+      engine = arg.split('=', 1)[1]
 
   print(print_knapsack(validate_and_solve_knapsack(
-    [('A', 1, 1), ('A', 6, 2), ('C', 10, 3), ('D', 16, 5)], (7,))))
+    [('A', 1, 1), ('A', 6, 2), ('C', 10, 3), ('D', 16, 5)], (7,), engine)))
   print(print_knapsack(validate_and_solve_knapsack(
-    [('A', 10, 10), ('B', 11, 11), ('C', 12, 12)], (30,))))
+    [('A', 10, 10), ('B', 11, 11), ('C', 12, 12)], (30,), engine)))
   print(print_knapsack(validate_and_solve_knapsack(
-    [('A', 10, 10), ('B', 11, 11), ('C', 12, 12)], (33,))))
+    [('A', 10, 10), ('B', 11, 11), ('C', 12, 12)], (33,), engine)))
   print(print_knapsack(validate_and_solve_knapsack(
-    [('A', 20, 15), ('B', 13, 8), ('C', 11, 8), ('D', 5, 5)], (20,))))
+    [('A', 20, 15), ('B', 13, 8), ('C', 11, 8), ('D', 5, 5)], (20,), engine)))
   print(print_knapsack(validate_and_solve_knapsack(
-    [('A', 11, 8), ('B', 13, 8), ('C', 20, 15), ('D', 5, 5)], (20,))))
+    [('A', 11, 8), ('B', 13, 8), ('C', 20, 15), ('D', 5, 5)], (20,), engine)))
   print(print_knapsack(validate_and_solve_knapsack(
-    [('A', 3, 3), ('B', 5, 5), ('C', 3, 3)], (6,))))
+    [('A', 3, 3), ('B', 5, 5), ('C', 3, 3)], (6,), engine)))
   print(print_knapsack(validate_and_solve_knapsack(
-    [('A', 1, 1), ('B', 6, 2), ('C', 10, 3), ('D', 16, 5)], (7,))))
+    [('A', 1, 1), ('B', 6, 2), ('C', 10, 3), ('D', 16, 5)], (7,), engine)))
   print(print_knapsack(validate_and_solve_knapsack(
-    [('A', 1, 1), ('B', 6, 2), ('C', 10, 3), ('D', 16, 5)], (6,))))
+    [('A', 1, 1), ('B', 6, 2), ('C', 10, 3), ('D', 16, 5)], (6,), engine)))
   print(print_knapsack(validate_and_solve_knapsack(
     [('A', 1, 1, 3), ('B', 6, 2, 2), ('C', 10, 3, 5), ('D', 16, 5, 4)],
-    (7, 7))))
+    (7, 7), engine)))
 
   print(print_knapsack(validate_and_solve_knapsack(
     [('A', 2, 1, 20),
@@ -210,7 +450,7 @@ if __name__ == '__main__':
      ('G', 2, 3, 45),
      ('H', 5, 3, 45),
      ('I', 7, 4, 50)],
-    (20, 245)
+    (20, 245), engine
     )))
 
   print(print_knapsack(validate_and_solve_knapsack(
@@ -224,7 +464,7 @@ if __name__ == '__main__':
      ('H', 80, 140, 4, 45),
      ('I', 90, 160, 2, 50),
      ('J', 100, 180, 1, 55)],
-    (300, 300, 100)
+    (300, 300, 100), engine
     )))
 
 
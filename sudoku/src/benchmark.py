@@ -0,0 +1,279 @@
+'''
+Sudoku benchmark
+
+This times the sudoku engines on the puzzle corpora in ../corpus:
+easy, hard, minimal17 (17 clue puzzles) and pathological (puzzles that
+are slow for backtracking search)
+
+For each corpus and engine it reports the latency percentiles per
+puzzle, puzzles per second, search nodes, guesses and peak memory
+
+To run, use the following command:
+  python3 benchmark.py
+
+Each puzzle is timed --repeat=N times (default 5) and its fastest time
+is kept.  Each repeat runs all the corpora and engines, so a slow spell
+of the machine only slows one timing of each puzzle.  The noise of a run
+is how much the total time of the repeats varies, relative to the fastest.
+
+The flag --save=FILE writes the results as JSON
+The flag --baseline=FILE compares the results with saved ones, and exits
+with status 1 if any node or guess count is higher, or any p50 latency or
+throughput is worse by more than the tolerance plus the noise of both runs
+The flag --tolerance=F sets the tolerance (default 0.25, i.e. 25%)
+The flag --counts-only compares only the node, guess and solved counts,
+for machines too noisy to compare times
+The flag --corpus=a,b and --engine=a,b limit what is run
+The flag --no-memory skips the peak memory pass, which is slow as it
+runs under tracemalloc
+
+The flag --sizes times the engines on random puzzles of each board size
+instead, with --count=N puzzles per size (default 5) and --holes=F
+the fraction of cells left empty (default 0.5)
+'''
+
+import datetime
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+import sudoku
+
+
+CORPUS_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', 'corpus')
+CORPORA = ['easy', 'hard', 'minimal17', 'pathological']
+
+
+def make_grid(size, rng):
+    '''Random solved grid, from a shuffled pattern grid'''
+    n = size * size
+    bands = rng.sample(range(size), size)
+    rows = [b * size + r for b in bands for r in rng.sample(range(size), size)]
+    stacks = rng.sample(range(size), size)
+    cols = [s * size + c for s in stacks for c in rng.sample(range(size), size)]
+    values = rng.sample(range(1, n + 1), n)
+    return [[values[(size * (r % size) + r // size + c) % n] for c in cols]
+            for r in rows]
+
+
+def make_puzzle(size, holes, rng):
+    '''Random puzzle with a fraction holes of the cells emptied
+
+       The puzzle has at least one solution, but may have more than one
+    '''
+    puzzle = make_grid(size, rng)
+    n = size * size
+    for i in rng.sample(range(n * n), int(holes * n * n)):
+        puzzle[i // n][i % n] = None
+    return puzzle
+
+
+def time_solve(puzzle, engine):
+    start = time.perf_counter()
+    soln = sudoku.solve(puzzle, engine)
+    return time.perf_counter() - start, soln is not None
+
+
+def bench_sizes(sizes=sudoku.SIZES, engines=None, count=5, holes=0.5,
+                seed=1):
+    '''Median solve time in seconds for each size and engine
+
+       returns a list of (size, engine, median, solved) tuples
+    '''
+    engines = engines or sorted(sudoku.ENGINES)
+    results = []
+    for size in sizes:
+        rng = random.Random(seed)
+        puzzles = [make_puzzle(size, holes, rng) for i in range(count)]
+        for engine in engines:
+            times = []
+            solved = 0
+            for puzzle in puzzles:
+                elapsed, ok = time_solve(puzzle, engine)
+                times.append(elapsed)
+                solved += ok
+            results.append(
+                (size, engine, sorted(times)[len(times) // 2], solved))
+    return results
+
+
+def load_corpus(name):
+    '''Puzzles of a corpus file, one per line, # starts a comment'''
+    puzzles = []
+    with open(os.path.join(CORPUS_DIR, f'{name}.txt')) as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+            if line:
+                puzzles.append(sudoku.parse_line(line))
+    return puzzles
+
+
+def percentile(values, p):
+    '''p-th percentile of sorted values, nearest rank'''
+    k = max(0, min(len(values) - 1, int(round(p / 100 * len(values))) - 1))
+    return values[k]
+
+
+def time_corpus(puzzles, engine):
+    '''Seconds to solve each of puzzles with engine'''
+    times = []
+    for puzzle in puzzles:
+        start = time.perf_counter()
+        sudoku.solve(puzzle, engine)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def bench_corpus(puzzles, engine, memory=True, repeat=5, timings=None):
+    '''Latency, search and memory figures for solving puzzles with engine
+
+       The latencies are the fastest of repeat timings of each puzzle, or
+       of timings, a list of time_corpus results if given.  The search
+       counters come from a separate pass, so counting does not slow the
+       timed ones.
+    '''
+    if timings is None:
+        timings = [time_corpus(puzzles, engine) for k in range(repeat)]
+    times = [min(t) for t in zip(*timings)]
+    totals = [sum(t) for t in timings]
+
+    stats = sudoku.SolveStats()
+    solved = 0
+    for puzzle in puzzles:
+        solved += sudoku.solve(puzzle, engine, stats=stats) is not None
+
+    peak = None
+    if memory:
+        tracemalloc.start()
+        for puzzle in puzzles:
+            sudoku.solve(puzzle, engine)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    times.sort()
+    return {
+        'puzzles': len(puzzles),
+        'solved': solved,
+        'p50_ms': percentile(times, 50) * 1000,
+        'p90_ms': percentile(times, 90) * 1000,
+        'p99_ms': percentile(times, 99) * 1000,
+        'max_ms': times[-1] * 1000,
+        'puzzles_per_sec': len(times) / sum(times),
+        'repeat': len(timings),
+        'noise': (max(totals) - min(totals)) / min(totals),
+        'nodes': stats.nodes,
+        'guesses': stats.guesses,
+        'peak_kb': None if peak is None else peak / 1024,
+    }
+
+
+def run_suite(corpora=CORPORA, engines=None, memory=True, repeat=5):
+    '''Run bench_corpus for each corpus and engine
+
+       returns a dict with the run details and the figures keyed by
+       corpus/engine
+    '''
+    engines = engines or sorted(sudoku.ENGINES)
+    puzzles = {name: load_corpus(name) for name in corpora}
+    timings = {(name, engine): [] for name in corpora for engine in engines}
+    for k in range(repeat):
+        for name, engine in timings:
+            timings[name, engine].append(time_corpus(puzzles[name], engine))
+    results = {}
+    for name, engine in timings:
+        results[f'{name}/{engine}'] = bench_corpus(
+            puzzles[name], engine, memory, timings=timings[name, engine])
+    return {
+        'date': datetime.datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'results': results,
+    }
+
+
+def compare(run, baseline, tolerance=0.25, times=True):
+    '''Regressions of run against baseline, as a list of messages
+
+       The node and guess counts do not depend on the machine, so any
+       increase means the search itself got worse.  Times are only
+       compared beyond tolerance plus the noise of both runs, and not at
+       all unless times is True.
+    '''
+    regressions = []
+    for key, base in baseline['results'].items():
+        now = run['results'].get(key)
+        if now is None:
+            continue
+        slack = 1 + tolerance + base.get('noise', 0) + now.get('noise', 0)
+        if times and now['p50_ms'] > base['p50_ms'] * slack:
+            regressions.append(
+                f'{key}: p50 {now["p50_ms"]:.2f} ms, was {base["p50_ms"]:.2f} ms')
+        if (times and
+                now['puzzles_per_sec'] * slack < base['puzzles_per_sec']):
+            regressions.append(
+                f'{key}: {now["puzzles_per_sec"]:.1f} puzzles/s, '
+                f'was {base["puzzles_per_sec"]:.1f}')
+        if now['nodes'] > base['nodes']:
+            regressions.append(
+                f'{key}: {now["nodes"]} nodes, was {base["nodes"]}')
+        if now['guesses'] > base['guesses']:
+            regressions.append(
+                f'{key}: {now["guesses"]} guesses, was {base["guesses"]}')
+        if now['solved'] < base['solved']:
+            regressions.append(
+                f'{key}: solved {now["solved"]}, was {base["solved"]}')
+    return regressions
+
+
+def print_suite(run):
+    print(f'{"corpus/engine":<22} {"p50 ms":>8} {"p90 ms":>8} {"p99 ms":>8} '
+          f'{"max ms":>8} {"per sec":>8} {"nodes":>8} {"guesses":>8} '
+          f'{"peak kb":>8}')
+    for key, r in run['results'].items():
+        peak = '-' if r['peak_kb'] is None else f'{r["peak_kb"]:.0f}'
+        print(f'{key:<22} {r["p50_ms"]:>8.2f} {r["p90_ms"]:>8.2f} '
+              f'{r["p99_ms"]:>8.2f} {r["max_ms"]:>8.2f} '
+              f'{r["puzzles_per_sec"]:>8.1f} {r["nodes"]:>8} '
+              f'{r["guesses"]:>8} {peak:>8}')
+
+
+if __name__ == '__main__':
+    if '--sizes' in sys.argv:
+        count = int(sudoku.arg_value('count', 5))
+        holes = float(sudoku.arg_value('holes', 0.5))
+
+        print(f'{"board":>7} {"engine":>8} {"median ms":>10} {"solved":>7}')
+        for size, engine, median, solved in bench_sizes(
+                count=count, holes=holes):
+            n = size * size
+            print(f'{f"{n}x{n}":>7} {engine:>8} {median * 1000:>10.2f} '
+                  f'{f"{solved}/{count}":>7}')
+        sys.exit(0)
+
+    corpora = sudoku.arg_value('corpus')
+    engines = sudoku.arg_value('engine')
+    run = run_suite(corpora.split(',') if corpora else CORPORA,
+                    engines.split(',') if engines else None,
+                    memory='--no-memory' not in sys.argv,
+                    repeat=int(sudoku.arg_value('repeat', 5)))
+    print_suite(run)
+
+    if sudoku.arg_value('save'):
+        with open(sudoku.arg_value('save'), 'w') as f:
+            json.dump(run, f, indent=2)
+
+    if sudoku.arg_value('baseline'):
+        with open(sudoku.arg_value('baseline')) as f:
+            baseline = json.load(f)
+        regressions = compare(
+            run, baseline, float(sudoku.arg_value('tolerance', 0.25)),
+            times='--counts-only' not in sys.argv)
+        for message in regressions:
+            print(f'REGRESSION {message}', file=sys.stderr)
+        if regressions:
+            sys.exit(1)
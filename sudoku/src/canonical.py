@@ -0,0 +1,305 @@
+'''
+Sudoku canonical form and solution cache
+
+Puzzles that are the same up to relabeling the values, permuting the
+rows within a band or the columns within a stack, permuting the bands
+or the stacks, and transposing, have the same solution up to the same
+changes.  canonical_form() maps a puzzle to the minimal one of all those
+puzzles, with the transform to map a solution back, so a solution cache
+keyed by the canonical form answers all of them.
+
+The order used is: first the pattern of filled cells, read row by row
+with empty before filled, then the values, relabeled in order of first
+appearance.  Comparing the patterns first lets most transforms be ruled
+out by sorting, without trying each of them.
+
+Very symmetric patterns, such as a full or empty board, leave too many
+transforms tied to try.  Past MAX_STATES or MAX_ORDERS the puzzle is its
+own canonical form, so it is only cached under its exact form.
+
+To run, use the following command:
+  python3 canonical.py < puzzles.txt
+
+It solves each puzzle of the one line format through the cache, and
+prints the number of cache hits at the end.
+'''
+
+import collections
+import itertools
+import math
+import shelve
+import sys
+
+import sudoku
+
+
+# Most tied row choices and column orders tried, real puzzles have a few
+MAX_STATES = 64
+MAX_ORDERS = 256
+
+
+class Transform:
+    '''Maps a puzzle to its canonical form
+
+       canonical[i][j] = relabel[grid[rows[i]][cols[j]]], where grid is the
+       puzzle, transposed if transpose is True
+    '''
+
+    def __init__(self, transpose, rows, cols, relabel):
+        self.transpose = transpose
+        self.rows = rows
+        self.cols = cols
+        self.relabel = relabel
+
+    def apply(self, puzzle):
+        grid = transposed(puzzle) if self.transpose else puzzle
+        return [[None if grid[r][c] is None else self.relabel[grid[r][c]]
+                 for c in self.cols] for r in self.rows]
+
+    def unmap(self, canonical):
+        '''Map a grid in the canonical frame, e.g. the solution of the
+           canonical puzzle, back to the frame of the original puzzle'''
+        n = len(canonical)
+        inverse = {v: k for k, v in self.relabel.items()}
+        grid = [[None] * n for r in range(n)]
+        for i, r in enumerate(self.rows):
+            for j, c in enumerate(self.cols):
+                val = canonical[i][j]
+                grid[r][c] = None if val is None else inverse[val]
+        return transposed(grid) if self.transpose else grid
+
+
+def transposed(grid):
+    return [list(col) for col in zip(*grid)]
+
+
+def arrange_columns(pattern, rows, size):
+    '''Column order giving the minimal pattern for the rows chosen so far
+
+       Within each stack the columns are sorted by their pattern over the
+       rows, and the stacks are sorted by their pattern read row by row.
+       returns the pattern read row by row, and the sorted stacks as
+       (pattern of the stack, its columns in order)
+    '''
+    stacks = []
+    for s in range(size):
+        cols = sorted(range(s * size, (s + 1) * size),
+                      key=lambda c: [pattern[r][c] for r in rows])
+        key = tuple(pattern[r][c] for r in rows for c in cols)
+        stacks.append((key, cols))
+    stacks.sort()
+    order = [c for key, cols in stacks for c in cols]
+    prefix = tuple(pattern[r][c] for r in rows for c in order)
+    return prefix, stacks
+
+
+def next_rows(rows, size):
+    '''Source rows that may come next, keeping bands together'''
+    if len(rows) % size:
+        band = rows[-1] // size
+        return [r for r in range(band * size, (band + 1) * size)
+                if r not in rows]
+    used = set(r // size for r in rows)
+    return [r for r in range(size * size) if r // size not in used]
+
+
+def tie_orders(stacks, pattern, rows):
+    '''Column orders that give the same minimal pattern
+
+       Columns with the same pattern within a stack, and stacks with the
+       same pattern, can be swapped.  Columns with no filled cells cannot
+       change the values either, so they are not swapped.
+    '''
+    def vector(c):
+        return [pattern[r][c] for r in rows]
+
+    def stack_orders(cols):
+        options = []
+        for k, group in itertools.groupby(cols, key=vector):
+            group = tuple(group)
+            options.append(itertools.permutations(group) if any(vector(group[0]))
+                           else [group])
+        return [[c for part in parts for c in part]
+                for parts in itertools.product(*options)]
+
+    choices = []
+    for key, group in itertools.groupby(stacks, key=lambda s: s[0]):
+        group = [stack_orders(cols) for key, cols in group]
+        orders = []
+        for perm in itertools.permutations(group):
+            for parts in itertools.product(*perm):
+                orders.append([c for part in parts for c in part])
+        choices.append(orders)
+    for parts in itertools.product(*choices):
+        yield [c for part in parts for c in part]
+
+
+def tie_order_count(stacks, pattern, rows):
+    '''Number of column orders tie_orders gives, without making them'''
+    def vector(c):
+        return [pattern[r][c] for r in rows]
+
+    count = 1
+    for key, group in itertools.groupby(stacks, key=lambda s: s[0]):
+        group = list(group)
+        count *= math.factorial(len(group))
+        for key, cols in group:
+            for k, same in itertools.groupby(cols, key=vector):
+                same = tuple(same)
+                if any(vector(same[0])):
+                    count *= math.factorial(len(same))
+    return count
+
+
+def identity(puzzle):
+    '''The puzzle as its own canonical form, with the Transform for it'''
+    n = len(puzzle)
+    transform = Transform(False, list(range(n)), list(range(n)),
+                          {v: v for v in range(1, n + 1)})
+    return transform.apply(puzzle), transform
+
+
+def relabeled(grid, rows, cols):
+    '''Values read row by row, relabeled in order of first appearance'''
+    relabel = {}
+    values = []
+    for r in rows:
+        for c in cols:
+            val = grid[r][c]
+            if val is not None and val not in relabel:
+                relabel[val] = len(relabel) + 1
+            values.append(0 if val is None else relabel[val])
+    return tuple(values), relabel
+
+
+def canonical_form(puzzle):
+    '''Minimal puzzle isomorphic to puzzle, and the Transform to it
+
+       If more than MAX_STATES row choices or MAX_ORDERS column orders
+       tie, returns the puzzle itself and the identity transform instead
+    '''
+    size = sudoku.sudoku_size(puzzle)
+    n = size * size
+
+    # Rows are chosen one at a time, keeping only the choices that give the
+    # minimal pattern so far, with the columns arranged by sorting
+    states = []
+    for transpose in (False, True):
+        grid = transposed(puzzle) if transpose else puzzle
+        pattern = [[val is not None for val in row] for row in grid]
+        states.append((transpose, grid, pattern, []))
+    for k in range(n):
+        best = None
+        extended = []
+        for transpose, grid, pattern, rows in states:
+            for r in next_rows(rows, size):
+                prefix, stacks = arrange_columns(pattern, rows + [r], size)
+                if best is None or prefix < best:
+                    best = prefix
+                    extended = []
+                if prefix == best:
+                    extended.append((transpose, grid, pattern, rows + [r]))
+                    if len(extended) > MAX_STATES:
+                        return identity(puzzle)
+        states = extended
+
+    # Among the minimal patterns, take the minimal relabeled values
+    arranged = []
+    for transpose, grid, pattern, rows in states:
+        prefix, stacks = arrange_columns(pattern, rows, size)
+        arranged.append((transpose, grid, pattern, rows, stacks))
+    if sum([tie_order_count(stacks, pattern, rows)
+            for transpose, grid, pattern, rows, stacks in arranged]) \
+            > MAX_ORDERS:
+        return identity(puzzle)
+    best = None
+    for transpose, grid, pattern, rows, stacks in arranged:
+        for cols in tie_orders(stacks, pattern, rows):
+            values, relabel = relabeled(grid, rows, cols)
+            if best is None or values < best[0]:
+                best = (values, Transform(transpose, rows, cols, relabel))
+
+    transform = best[1]
+    # Values missing from the puzzle get the remaining labels in order,
+    # so a solution can always be mapped back
+    missing = [v for v in range(1, n + 1) if v not in transform.relabel]
+    for v in missing:
+        transform.relabel[v] = len(transform.relabel) + 1
+    return transform.apply(puzzle), transform
+
+
+class SolutionCache:
+    '''LRU cache of solutions keyed by canonical form
+
+       Keys and solutions are in the one line format, an unsolvable puzzle
+       is cached as an empty string.  If path is given, entries are also
+       kept in a shelve file there, and looked up when not in memory.
+    '''
+
+    def __init__(self, maxsize=10000, path=None):
+        self.maxsize = maxsize
+        self.entries = collections.OrderedDict()
+        self.shelf = shelve.open(path) if path else None
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+        if self.shelf is not None and key in self.shelf:
+            self.hits += 1
+            self.store(key, self.shelf[key])
+            return self.entries[key]
+        self.misses += 1
+        return None
+
+    def put(self, key, soln):
+        self.store(key, soln)
+        if self.shelf is not None:
+            self.shelf[key] = soln
+
+    def store(self, key, soln):
+        self.entries[key] = soln
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def close(self):
+        if self.shelf is not None:
+            self.shelf.close()
+            self.shelf = None
+
+
+def solve_cached(puzzle, cache, engine='search', **options):
+    '''Solve puzzle, answering repeated and isomorphic puzzles from cache
+
+       The puzzle is validated first, as transforms of an invalid puzzle
+       are not checked.  returns the solved grid or None, as try_solve
+    '''
+    if not sudoku.check_square(puzzle):
+        return None
+    if all([val is not None for row in puzzle for val in row]):
+        return puzzle if sudoku.check_solved(puzzle) else None
+
+    canonical, transform = canonical_form(puzzle)
+    key = sudoku.format_line(canonical)
+    soln = cache.get(key)
+    if soln is None:
+        solved = sudoku.solve(canonical, engine, **options)
+        soln = sudoku.format_line(solved) if solved else ''
+        cache.put(key, soln)
+    if not soln:
+        return None
+    return transform.unmap(sudoku.parse_line(soln))
+
+
+if __name__ == '__main__':
+    cache = SolutionCache(path=sudoku.arg_value('cache'))
+    for line in sys.stdin:
+        puzzle = sudoku.parse_line(line)
+        soln = solve_cached(puzzle, cache) if puzzle else None
+        print(sudoku.format_line(soln) if soln else str(None))
+    print(f'hits {cache.hits}, misses {cache.misses}', file=sys.stderr)
+    cache.close()
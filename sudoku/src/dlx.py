@@ -0,0 +1,164 @@
+'''
+Dancing Links
+
+This solves exact cover problems with Knuth's Algorithm X, using
+dancing links so that covering and uncovering a column is O(1) per node
+
+The matrix is given as a list of rows, each row being a list of the
+column numbers that have a 1 in that row.  A solution is a list of row
+numbers such that every column has exactly one 1 in the selected rows.
+'''
+
+
+class ExactCover:
+    '''Sparse exact cover matrix linked as a torus of nodes
+
+       Node 0 is the root, nodes 1..num_columns are the column headers,
+       and the rest are the 1s of the matrix.  The links are kept in flat
+       lists rather than node objects, which is much faster in Python.
+
+       nodes counts the rows tried by the search, and guesses those of
+       them tried in a column that had more than one row left.
+    '''
+
+    def __init__(self, num_columns, rows):
+        n = num_columns + 1
+        self.left = [i - 1 for i in range(n)]
+        self.right = [i + 1 for i in range(n)]
+        self.left[0] = num_columns
+        self.right[num_columns] = 0
+        self.up = list(range(n))
+        self.down = list(range(n))
+        self.column = list(range(n))
+        self.row = [-1] * n
+        self.size = [0] * n
+        self.nodes = 0
+        self.guesses = 0
+
+        for r, columns in enumerate(rows):
+            first = None
+            for c in columns:
+                node = len(self.column)
+                c += 1
+                self.column.append(c)
+                self.row.append(r)
+                self.up.append(self.up[c])
+                self.down.append(c)
+                self.down[self.up[c]] = node
+                self.up[c] = node
+                self.size[c] += 1
+                if first is None:
+                    first = node
+                    self.left.append(node)
+                    self.right.append(node)
+                else:
+                    self.left.append(self.left[first])
+                    self.right.append(first)
+                    self.right[self.left[first]] = node
+                    self.left[first] = node
+
+    def cover(self, c):
+        left, right, up, down = self.left, self.right, self.up, self.down
+        column, size = self.column, self.size
+        right[left[c]] = right[c]
+        left[right[c]] = left[c]
+        i = down[c]
+        while i != c:
+            j = right[i]
+            while j != i:
+                down[up[j]] = down[j]
+                up[down[j]] = up[j]
+                size[column[j]] -= 1
+                j = right[j]
+            i = down[i]
+
+    def uncover(self, c):
+        left, right, up, down = self.left, self.right, self.up, self.down
+        column, size = self.column, self.size
+        i = up[c]
+        while i != c:
+            j = left[i]
+            while j != i:
+                size[column[j]] += 1
+                down[up[j]] = j
+                up[down[j]] = j
+                j = left[j]
+            i = up[i]
+        right[left[c]] = c
+        left[right[c]] = c
+
+    def choose(self):
+        '''Column with the fewest 1s left, first one on ties'''
+        right, size = self.right, self.size
+        best = right[0]
+        c = right[best]
+        while c != 0 and size[best] > 0:
+            if size[c] < size[best]:
+                best = c
+            c = right[c]
+        return best
+
+    def solutions(self):
+        '''Generate each exact cover as a list of row numbers
+
+           The search is iterative, so deep covers do not hit the
+           recursion limit.
+        '''
+        right, left, down, column = self.right, self.left, self.down, self.column
+        size = self.size
+        if right[0] == 0:
+            yield []
+            return
+
+        chosen = []
+        c = self.choose()
+        self.cover(c)
+        r = down[c]
+        while True:
+            if r == c:
+                # All rows of column c tried, go back to the previous choice
+                self.uncover(c)
+                if not chosen:
+                    return
+                r = chosen.pop()
+                c = column[r]
+                j = left[r]
+                while j != r:
+                    self.uncover(column[j])
+                    j = left[j]
+                r = down[r]
+                continue
+
+            chosen.append(r)
+            self.nodes += 1
+            if size[c] > 1:
+                self.guesses += 1
+            j = right[r]
+            while j != r:
+                self.cover(column[j])
+                j = right[j]
+
+            if right[0] == 0:
+                yield [self.row[i] for i in chosen]
+                chosen.pop()
+                j = left[r]
+                while j != r:
+                    self.uncover(column[j])
+                    j = left[j]
+                r = down[r]
+                continue
+
+            c = self.choose()
+            self.cover(c)
+            r = down[c]
+
+
+def solve_exact_cover(num_columns, rows, cover=None):
+    '''Return the first exact cover of rows, or None
+
+       An ExactCover for the rows can be passed in to read its counters
+    '''
+    cover = cover or ExactCover(num_columns, rows)
+    for solution in cover.solutions():
+        return solution
+    return None
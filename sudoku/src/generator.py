@@ -0,0 +1,135 @@
+'''
+Sudoku generator
+
+This makes sudoku puzzles with a unique solution and grades them
+
+To run, use the following command:
+  python3 generator.py --count=100 --seed=1
+
+Each puzzle is written on one line in the 81 character format,
+followed by its grade and the number of guesses needed to solve it
+
+The flag --size=N sets the box size (default 3)
+The flag --processes=N sets the number of workers (default is one per cpu)
+'''
+
+import multiprocessing
+import random
+import sys
+
+import sudoku
+
+
+# Techniques used for the uniqueness check after each clue is removed,
+# singles and branching on the fewest candidates are the fastest there
+UNIQUE_TECHNIQUES = ('naked_single', 'hidden_single')
+
+# Grades, easiest first, with the techniques that make a puzzle that grade
+GRADES = [
+    ('easy', ('naked_single', 'hidden_single')),
+    ('medium', ('naked_pair', 'hidden_pair', 'pointing', 'box_line')),
+    ('hard', ('naked_triple', 'hidden_triple')),
+    ('expert', ()),
+]
+
+
+def full_grid(rng, size=3):
+    '''Random solved grid
+
+       The boxes on the diagonal do not share any rows or columns, so they
+       are filled with random permutations and the rest is solved.  Small
+       boards cannot always be completed that way, so it is retried.
+    '''
+    n = size * size
+    solved = None
+    while solved is None:
+        board = sudoku.Board(size=size)
+        for d in range(size):
+            values = rng.sample(range(1, n + 1), n)
+            for k, i in enumerate(board.units.box_cells[d * size + d]):
+                board.place(board.units.row[i], board.units.col[i], values[k])
+        solved = sudoku.solve_board(board, UNIQUE_TECHNIQUES)
+    return solved.grid()
+
+
+def remove_clues(grid, rng, min_clues=0):
+    '''Remove clues from grid in random order while the solution stays
+       unique, keeping at least min_clues'''
+    puzzle = sudoku.copy(grid)
+    n = len(grid)
+    clues = n * n
+    for i in rng.sample(range(n * n), n * n):
+        if clues <= min_clues:
+            break
+        r, c = i // n, i % n
+        val = puzzle[r][c]
+        puzzle[r][c] = None
+        if sudoku.count_solutions(puzzle, 2, UNIQUE_TECHNIQUES) != 1:
+            puzzle[r][c] = val
+        else:
+            clues -= 1
+    return puzzle
+
+
+def grade(puzzle):
+    '''Grade puzzle by the hardest technique and the number of guesses
+       its solve needed
+
+       Propagation always goes back to the cheapest technique after any
+       progress, so any technique that made progress was needed.
+       returns (grade, guesses, names of the techniques used)
+    '''
+    stats = sudoku.SolveStats()
+    sudoku.try_solve(puzzle, stats=stats)
+    used = [name for name, s in stats.techniques.items()
+            if s.placed or s.eliminated]
+    if stats.guesses:
+        return GRADES[-1][0], stats.guesses, used
+    for name, techniques in reversed(GRADES[:-1]):
+        if set(used) & set(techniques):
+            return name, 0, used
+    return GRADES[0][0], 0, used
+
+
+def make_puzzle(rng, size=3, min_clues=0):
+    '''Random puzzle with a unique solution, and its grade'''
+    puzzle = remove_clues(full_grid(rng, size), rng, min_clues)
+    return puzzle, grade(puzzle)
+
+
+def make_indexed(task):
+    '''Make puzzle number index of a run, in a worker process
+
+       Each puzzle has its own random generator seeded from the run seed
+       and the index, so a run gives the same puzzles whatever the number
+       of workers and the order they finish in.
+    '''
+    seed, index, size, min_clues = task
+    return make_puzzle(random.Random(f'{seed}:{index}'), size, min_clues)
+
+
+def generate(count, seed=0, size=3, min_clues=0, processes=None):
+    '''Generate count graded puzzles, in order, with a worker pool
+
+       The uniqueness checks for each puzzle depend on the clues removed
+       before, so the work is spread across the cpus a puzzle at a time.
+       yields (puzzle, (grade, guesses, techniques))
+    '''
+    tasks = ((seed, index, size, min_clues) for index in range(count))
+    with multiprocessing.Pool(
+            processes, initializer=sudoku.quiet_worker) as pool:
+        for result in pool.imap(make_indexed, tasks, chunksize=4):
+            yield result
+
+
+if __name__ == '__main__':
+    count = int(sudoku.arg_value('count', 10))
+    seed = int(sudoku.arg_value('seed', 0))
+    size = int(sudoku.arg_value('size', 3))
+    processes = sudoku.arg_value('processes')
+
+    for puzzle, (name, guesses, used) in generate(
+            count, seed, size,
+            processes=int(processes) if processes else None):
+        print(f'{sudoku.format_line(puzzle)} {name} {guesses}')
+    sys.stdout.flush()
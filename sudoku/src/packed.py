@@ -0,0 +1,204 @@
+'''
+Packed sudoku boards and memory mapped corpora
+
+A packed board has one 4 bit value per cell for boards up to 9x9, two
+cells to a byte, so a 9x9 board takes 41 bytes.  Larger boards have one
+byte per cell.  0 is an empty cell, as in the one line format.
+
+A packed corpus file is a header followed by packed boards, all of the
+same size, so the board at any index is at a fixed offset.  PackedCorpus
+memory maps the file, so a batch job can read any puzzle by index without
+parsing the file or building lists for the puzzles it does not solve.
+
+To run, use one of the following commands:
+  python3 packed.py --pack=puzzles.sdk < puzzles.txt
+  python3 packed.py --unpack=puzzles.sdk
+  python3 packed.py --solve=puzzles.sdk
+
+--pack reads puzzles in the one line format and writes a corpus file,
+--unpack writes a corpus file back in the one line format, and --solve
+solves it with a worker pool, writing the solutions in order.
+The flags --start=N and --stop=N limit --unpack and --solve to a range
+of indexes, --processes=N sets the number of workers and --dlx the engine.
+'''
+
+import mmap
+import multiprocessing
+import struct
+import sys
+
+import sudoku
+
+
+MAGIC = b'SDKP'
+VERSION = 1
+# magic, version, size, bytes per board, number of boards
+HEADER = struct.Struct('<4sBBHQ')
+
+
+def cell_bits(size):
+    return 4 if size * size < 16 else 8
+
+
+def packed_length(size):
+    '''Bytes in a packed board of the given size'''
+    cells = size ** 4
+    return (cells + 1) // 2 if cell_bits(size) == 4 else cells
+
+
+def pack(puzzle):
+    '''Packed bytes of a puzzle'''
+    values = [0 if val is None else val for row in puzzle for val in row]
+    if cell_bits(sudoku.sudoku_size(puzzle)) == 8:
+        return bytes(values)
+    if len(values) % 2:
+        values.append(0)
+    return bytes((values[i] << 4) | values[i + 1]
+                 for i in range(0, len(values), 2))
+
+
+def unpack_values(data, size):
+    '''Cell values of a packed board, row by row, 0 for an empty cell'''
+    cells = size ** 4
+    if cell_bits(size) == 8:
+        return list(data[:cells])
+    values = []
+    for b in data:
+        values.append(b >> 4)
+        values.append(b & 0xF)
+    return values[:cells]
+
+
+def unpack(data, size):
+    '''Puzzle of a packed board, as from parse_line'''
+    n = size * size
+    values = [None if val == 0 else val for val in unpack_values(data, size)]
+    return [values[r * n:(r + 1) * n] for r in range(n)]
+
+
+def write_corpus(path, puzzles, size=None):
+    '''Write puzzles as a packed corpus file, returning the count
+
+       puzzles may be any iterable, it is written as it is read.  All of
+       them must be of the same size, which defaults to that of the first.
+    '''
+    count = 0
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, 0, 0, 0))
+        for puzzle in puzzles:
+            if size is None:
+                size = sudoku.sudoku_size(puzzle)
+            if sudoku.sudoku_size(puzzle) != size:
+                raise ValueError(f'puzzle {count} is not of size {size}')
+            f.write(pack(puzzle))
+            count += 1
+        size = size or sudoku.sudoku_size()
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, VERSION, size, packed_length(size), count))
+    return count
+
+
+class PackedCorpus:
+    '''Memory mapped packed corpus file, indexable like a list of puzzles
+
+       corpus[i] unpacks puzzle i, corpus.raw(i) is its packed bytes
+    '''
+
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.map) < HEADER.size:
+            self.close()
+            raise ValueError(f'{path} is not a packed corpus')
+        magic, version, self.size, self.length, self.count = \
+            HEADER.unpack_from(self.map)
+        if (magic != MAGIC or version != VERSION or
+                len(self.map) < HEADER.size + self.length * self.count):
+            self.close()
+            raise ValueError(f'{path} is not a packed corpus')
+
+    def __len__(self):
+        return self.count
+
+    def raw(self, index):
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+        start = HEADER.size + index * self.length
+        return self.map[start:start + self.length]
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.count
+        return unpack(self.raw(index), self.size)
+
+    def __iter__(self):
+        for index in range(self.count):
+            yield self[index]
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+_corpus = None
+
+
+def solve_range(task):
+    '''Solve the puzzles start to stop of a corpus in a worker process
+
+       Each worker maps the corpus once, and only gets the indexes.
+    '''
+    global _corpus
+    path, engine, start, stop = task
+    if _corpus is None or _corpus.file.name != path:
+        _corpus = PackedCorpus(path)
+    results = []
+    for index in range(start, stop):
+        soln = sudoku.solve(_corpus[index], engine)
+        results.append(sudoku.format_line(soln) if soln else str(None))
+    return results
+
+
+def solve_corpus(path, out, engine='search', processes=None, start=0,
+                 stop=None, chunksize=64):
+    '''Solve the puzzles of a packed corpus file with a worker pool,
+       writing the solutions to out in order, one per line'''
+    with PackedCorpus(path) as corpus:
+        count = len(corpus)
+    stop = count if stop is None else min(stop, count)
+    tasks = ((path, engine, i, min(i + chunksize, stop))
+             for i in range(start, stop, chunksize))
+    with multiprocessing.Pool(processes, initializer=sudoku.quiet_worker) \
+            as pool:
+        for results in pool.imap(solve_range, tasks):
+            for soln in results:
+                out.write(f'{soln}\n')
+
+
+if __name__ == '__main__':
+    start = int(sudoku.arg_value('start', 0))
+    stop = sudoku.arg_value('stop')
+    stop = int(stop) if stop is not None else None
+    if sudoku.arg_value('pack'):
+        puzzles = (sudoku.parse_line(line) for line in sys.stdin
+                   if line.strip())
+        count = write_corpus(sudoku.arg_value('pack'),
+                             (p for p in puzzles if p is not None))
+        print(f'packed {count}', file=sys.stderr)
+    elif sudoku.arg_value('unpack'):
+        with PackedCorpus(sudoku.arg_value('unpack')) as corpus:
+            for index in range(start, len(corpus) if stop is None
+                               else min(stop, len(corpus))):
+                print(sudoku.format_line(corpus[index]))
+    elif sudoku.arg_value('solve'):
+        processes = sudoku.arg_value('processes')
+        solve_corpus(sudoku.arg_value('solve'), sys.stdout,
+                     'dlx' if '--dlx' in sys.argv else 'search',
+                     processes=int(processes) if processes else None,
+                     start=start, stop=stop)
@@ -0,0 +1,282 @@
+'''
+Sudoku solving service
+
+This solves puzzles for asyncio code without blocking the event loop.
+SolverPool runs the solves in worker processes, with a deadline per
+request, a bound on the number of queued requests, and metrics.  A
+solve that is cancelled or runs past its deadline has its worker
+process stopped and replaced, so it does not keep using a cpu.
+
+To run a server, use one of the following commands:
+  python3 service.py --port=8765
+  python3 service.py --unix=/tmp/sudoku.sock
+
+The protocol is one request per line: a puzzle in the one line format,
+optionally followed by a deadline in milliseconds.  Each request gets
+one line back, in order: the solution, None if it has no solution, or
+ERROR and a reason (invalid, timeout, busy, internal).  The line METRICS
+gets the metrics as JSON.  When a client disconnects, its requests that
+are still queued or being solved are cancelled.  End of input counts as
+a disconnect, unless the server is run with --half-close: then a client
+that shuts down its side of the connection after sending still gets all
+its replies, and its requests are only cancelled once a reply cannot be
+written.
+
+The flag --processes=N sets the number of workers (default is one per cpu)
+The flag --max-queue=N sets how many requests may wait for a worker
+The flag --timeout=MS sets the default deadline
+The flag --half-close keeps answering after end of input, as above
+'''
+
+import asyncio
+import collections
+import concurrent.futures
+import json
+import multiprocessing
+import sys
+import time
+
+import sudoku
+
+
+class Busy(Exception):
+    '''The queue of requests waiting for a worker is full'''
+
+
+def worker_main(conn):
+    '''Solve (puzzle, engine) requests from conn until it sends None'''
+    sudoku.quiet_worker()
+    while True:
+        request = conn.recv()
+        if request is None:
+            break
+        puzzle, engine = request
+        conn.send(sudoku.solve(puzzle, engine))
+
+
+# Workers are spawned rather than forked, so a worker started to replace
+# another does not inherit the sockets of the connections open then, which
+# would keep them open after the server closes them
+CONTEXT = multiprocessing.get_context('spawn')
+
+
+class Worker:
+    '''A solver process, and the pipe to it'''
+
+    def __init__(self):
+        self.conn, child = CONTEXT.Pipe()
+        self.process = CONTEXT.Process(
+            target=worker_main, args=(child,), daemon=True)
+        self.process.start()
+        child.close()
+
+    def stop(self):
+        self.process.terminate()
+        self.process.join()
+        self.conn.close()
+
+
+class SolverPool:
+    '''Worker processes solving puzzles for asyncio code
+
+       At most max_queue requests wait for a worker, beyond that solve()
+       raises Busy at once, so callers can shed load instead of queueing
+       without bound.
+    '''
+
+    def __init__(self, processes=None, max_queue=100, window=1000):
+        self.processes = processes or multiprocessing.cpu_count()
+        self.max_queue = max_queue
+        self.workers = [Worker() for i in range(self.processes)]
+        self.idle = None
+        # Threads to wait on the worker pipes, so the event loop never blocks
+        self.readers = concurrent.futures.ThreadPoolExecutor(self.processes)
+        self.waiting = 0
+        self.running = 0
+        self.counts = collections.Counter()
+        self.latencies = collections.deque(maxlen=window)
+
+    async def solve(self, puzzle, engine='search', timeout=None):
+        '''Solve puzzle in a worker, returning the solved grid or None
+
+           timeout is in seconds, counted from the call, so it includes
+           any wait for a worker.  Raises Busy if the queue is full and
+           asyncio.TimeoutError if the deadline passes.
+        '''
+        if self.idle is None:
+            self.idle = asyncio.Queue()
+            for worker in self.workers:
+                self.idle.put_nowait(worker)
+        if self.idle.empty() and self.waiting >= self.max_queue:
+            self.counts['rejected'] += 1
+            raise Busy()
+
+        start = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(
+                self.run(puzzle, engine), timeout)
+        except asyncio.TimeoutError:
+            self.counts['timeouts'] += 1
+            raise
+        except asyncio.CancelledError:
+            self.counts['cancelled'] += 1
+            raise
+        self.counts['solved'] += 1
+        self.latencies.append(time.perf_counter() - start)
+        return result
+
+    async def run(self, puzzle, engine):
+        self.waiting += 1
+        try:
+            worker = await self.idle.get()
+        finally:
+            self.waiting -= 1
+
+        self.running += 1
+        try:
+            worker.conn.send((puzzle, engine))
+            result = await asyncio.get_running_loop().run_in_executor(
+                self.readers, worker.conn.recv)
+        except BaseException:
+            # The worker may still be solving, replace it
+            worker.stop()
+            self.workers.remove(worker)
+            worker = Worker()
+            self.workers.append(worker)
+            raise
+        finally:
+            self.running -= 1
+            self.idle.put_nowait(worker)
+        return result
+
+    def metrics(self):
+        latencies = sorted(self.latencies)
+
+        def percentile(p):
+            if not latencies:
+                return None
+            return latencies[min(len(latencies) - 1,
+                                 int(p / 100 * len(latencies)))] * 1000
+
+        return {
+            'queue_depth': self.waiting,
+            'running': self.running,
+            'workers': self.processes,
+            'solved': self.counts['solved'],
+            'timeouts': self.counts['timeouts'],
+            'cancelled': self.counts['cancelled'],
+            'rejected': self.counts['rejected'],
+            'p50_ms': percentile(50),
+            'p99_ms': percentile(99),
+        }
+
+    def close(self):
+        for worker in self.workers:
+            worker.stop()
+        self.readers.shutdown(wait=False)
+
+
+async def answer(pool, line, timeout):
+    '''Reply line for a request line'''
+    parts = line.split()
+    if parts == ['METRICS']:
+        return json.dumps(pool.metrics())
+    puzzle = sudoku.parse_line(parts[0]) if parts else None
+    if puzzle is None or not sudoku.check_square(puzzle):
+        return 'ERROR invalid'
+    if len(parts) > 1:
+        try:
+            timeout = int(parts[1]) / 1000
+        except ValueError:
+            return 'ERROR invalid'
+    try:
+        soln = await pool.solve(puzzle, timeout=timeout)
+    except asyncio.TimeoutError:
+        return 'ERROR timeout'
+    except Busy:
+        return 'ERROR busy'
+    except Exception:
+        # e.g. EOFError if the worker died, it has been replaced
+        return 'ERROR internal'
+    return sudoku.format_line(soln) if soln else str(None)
+
+
+async def handle_client(pool, timeout, reader, writer, half_close=False):
+    '''Answer the requests of one connection in order
+
+       Each request is solved as soon as it is read, and the replies are
+       written in order as they are done.  At end of input, the requests
+       still pending are cancelled, as the client has gone.  If
+       half_close, end of input is taken as the client only shutting down
+       its side, so the pending replies are written first, and the
+       requests are cancelled only if a write fails.
+    '''
+    replies = asyncio.Queue()
+
+    async def write_replies():
+        while True:
+            task = await replies.get()
+            if task is None:
+                break
+            try:
+                reply = await task
+            except Exception:
+                reply = 'ERROR internal'
+            try:
+                writer.write((reply + '\n').encode())
+                await writer.drain()
+            except ConnectionError:
+                break
+
+    writing = asyncio.create_task(write_replies())
+    pending = []
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            task = asyncio.create_task(
+                answer(pool, line.decode().strip(), timeout))
+            pending.append(task)
+            replies.put_nowait(task)
+        if half_close:
+            replies.put_nowait(None)
+            await writing
+    finally:
+        for task in pending:
+            task.cancel()
+        writing.cancel()
+        writer.close()
+
+
+async def serve(port=None, unix=None, processes=None, max_queue=100,
+                timeout=None, half_close=False):
+    pool = SolverPool(processes, max_queue)
+
+    def connected(reader, writer):
+        return handle_client(pool, timeout, reader, writer, half_close)
+
+    if unix:
+        server = await asyncio.start_unix_server(connected, unix)
+    else:
+        server = await asyncio.start_server(connected, '127.0.0.1', port)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        pool.close()
+
+
+if __name__ == '__main__':
+    processes = sudoku.arg_value('processes')
+    timeout = sudoku.arg_value('timeout')
+    try:
+        asyncio.run(serve(
+            port=int(sudoku.arg_value('port', 8765)),
+            unix=sudoku.arg_value('unix'),
+            processes=int(processes) if processes else None,
+            max_queue=int(sudoku.arg_value('max-queue', 100)),
+            timeout=int(timeout) / 1000 if timeout else None,
+            half_close='--half-close' in sys.argv))
+    except KeyboardInterrupt:
+        sys.exit(0)
@@ -1,32 +1,318 @@
 
+import collections
 import datetime
+import inspect
+import itertools
+import math
+import multiprocessing
+import multiprocessing.connection
 import sys
+import threading
+import time
 
+import dlx
 
-def sudoku_size():
-    return 3
+
+# Set to a Tracer to record what the solver does, see Tracer
+TRACE = None
+
+# Supported box sizes, from 4x4 up to 25x25 puzzles
+SIZES = range(2, 6)
+
+# Characters for values in the one line format, empty cells are 0 or .
+VALUE_CHARS = '123456789ABCDEFGHIJKLMNOP'
+
+
+def sudoku_size(puzzle=None):
+    '''Box size of puzzle, from its number of rows (3 for a 9x9 puzzle)'''
+    if puzzle is None:
+        return 3
+    return math.isqrt(len(puzzle))
 
 
 def min_val():
     return 1
 
 
-def max_val():
-    return sudoku_size() * sudoku_size()
+def max_val(puzzle=None):
+    return sudoku_size(puzzle) * sudoku_size(puzzle)
 
 
 def copy(puzzle):
+    if TRACE:
+        TRACE.count('copy')
     return [list(r) for r in puzzle]
 
 
-def check_line(line):
-    if type(line) != list or len(line) != max_val():
+TraceEvent = collections.namedtuple('TraceEvent', 'kind row col value rule')
+
+
+class Tracer:
+    '''Records what the solver does while it is set as TRACE
+
+       Events are kept in a ring buffer of the last size of them, each a
+       TraceEvent of kind place, guess or backtrack, or rule for a
+       propagation technique that made progress.  Calls of check_square,
+       copy and the find functions are counted.  With TRACE left as None,
+       each of these costs a single test.
+
+       If out is given, the profile is written to it after each solve().
+    '''
+
+    def __init__(self, size=10000, out=None):
+        self.events = collections.deque(maxlen=size)
+        self.kinds = collections.Counter()
+        self.rules = collections.Counter()
+        self.calls = collections.Counter()
+        self.solves = 0
+        self.out = out
+
+    def event(self, kind, row=None, col=None, value=None, rule=None):
+        self.events.append(TraceEvent(kind, row, col, value, rule))
+        self.kinds[kind] += 1
+        if kind == 'rule':
+            self.rules[rule] += 1
+
+    def count(self, name):
+        self.calls[name] += 1
+
+    def solved(self, engine, soln):
+        self.solves += 1
+        if self.out:
+            print(f'solve {self.solves} ({engine}): '
+                  f'{"solved" if soln else "no solution"}', file=self.out)
+            print(self.profile(), file=self.out)
+
+    def format_events(self):
+        lines = []
+        for e in self.events:
+            if e.row is None:
+                lines.append(f'{e.kind} {e.rule}' if e.rule else e.kind)
+            else:
+                lines.append(f'{e.kind} row {e.row + 1} col {e.col + 1} '
+                             f'to {e.value}' + (f' ({e.rule})' if e.rule else ''))
+        return '\n'.join(lines)
+
+    def profile(self):
+        lines = ['events ' + ', '.join(
+            f'{kind} {k}' for kind, k in sorted(self.kinds.items()))]
+        if self.rules:
+            lines.append('rules ' + ', '.join(
+                f'{rule} {k}' for rule, k in self.rules.most_common()))
+        if self.calls:
+            lines.append('calls ' + ', '.join(
+                f'{name} {k}' for name, k in self.calls.most_common()))
+        return '\n'.join(lines)
+
+    def reset(self):
+        self.events.clear()
+        self.kinds.clear()
+        self.rules.clear()
+        self.calls.clear()
+
+
+class Units:
+    '''Row, column, box and peer lookups for each cell of a puzzle
+
+    Cells are numbered row by row, so cell i is at row i // n, col i % n
+    '''
+
+    def __init__(self, size):
+        n = size * size
+        cells = range(n * n)
+        self.size = size
+        self.row = [i // n for i in cells]
+        self.col = [i % n for i in cells]
+        self.box = [(self.row[i] // size) * size + self.col[i] // size
+                    for i in cells]
+        self.row_cells = [[i for i in cells if self.row[i] == u]
+                          for u in range(n)]
+        self.col_cells = [[i for i in cells if self.col[i] == u]
+                          for u in range(n)]
+        self.box_cells = [[i for i in cells if self.box[i] == u]
+                          for u in range(n)]
+        self.all_units = self.row_cells + self.col_cells + self.box_cells
+        self.peers = [
+            sorted(set(self.row_cells[self.row[i]]
+                       + self.col_cells[self.col[i]]
+                       + self.box_cells[self.box[i]]) - set([i]))
+            for i in cells]
+
+
+_UNITS = {}
+
+
+def units_for(size):
+    if size not in _UNITS:
+        _UNITS[size] = Units(size)
+    return _UNITS[size]
+
+
+class Board:
+    '''Candidate bitmasks for a puzzle
+
+    Value v is stored as bit v - 1.  cand[i] has the values still possible
+    in open cell i (0 once the cell is set).  rows, cols and boxes have the
+    values already used in each unit.  All masks are updated incrementally
+    by place(), so no full board scan is needed after each placement.
+
+    counts has how often each value is used in each unit, so conflicts
+    (repeated values in a unit) and filled cells are tracked as running
+    totals, and valid() and solved() are O(1).
+
+    Every change made by place() and eliminate() is recorded on trail, so
+    the search can work on a single board: take a mark() before a guess
+    and undo(mark) to go back to that point.
+    '''
+
+    def __init__(self, puzzle=None, size=None):
+        self.size = size or sudoku_size(puzzle)
+        self.units = units_for(self.size)
+        self.n = n = self.size * self.size
+        self.full = (1 << n) - 1
+        self.cells = [None] * (n * n)
+        self.cand = [self.full] * (n * n)
+        self.rows = [0] * n
+        self.cols = [0] * n
+        self.boxes = [0] * n
+        # Units are rows 0..n-1, then cols n..2n-1, then boxes 2n..3n-1
+        self.counts = [[0] * (n + 1) for u in range(3 * n)]
+        self.conflicts = 0
+        self.filled = 0
+        # (cell, old cand) to restore a candidate mask, or
+        # (-1 - cell, value) to unset a placed value
+        self.trail = []
+        if puzzle is None:
+            return
+
+        for r, row in enumerate(puzzle):
+            for c, val in enumerate(row):
+                if val is not None:
+                    self.place(r, c, val)
+        self.trail = []
+
+    def copy(self):
+        board = Board.__new__(Board)
+        board.size = self.size
+        board.units = self.units
+        board.n = self.n
+        board.full = self.full
+        board.cells = list(self.cells)
+        board.cand = list(self.cand)
+        board.rows = list(self.rows)
+        board.cols = list(self.cols)
+        board.boxes = list(self.boxes)
+        board.counts = [list(c) for c in self.counts]
+        board.conflicts = self.conflicts
+        board.filled = self.filled
+        board.trail = list(self.trail)
+        return board
+
+    def valid(self):
+        return self.conflicts == 0
+
+    def solved(self):
+        return self.conflicts == 0 and self.filled == len(self.cells)
+
+    def mark(self):
+        return len(self.trail)
+
+    def undo(self, mark):
+        '''Undo all changes made since mark'''
+        trail = self.trail
+        cand = self.cand
+        while len(trail) > mark:
+            i, old = trail.pop()
+            if i >= 0:
+                cand[i] = old
+            else:
+                self.unset(-1 - i)
+
+    def place(self, r, c, val):
+        units = self.units
+        n = self.n
+        i = r * n + c
+        b = units.box[i]
+        bit = 1 << (val - 1)
+        if self.cells[i] is not None:
+            self.clear(r, c)
+        trail = self.trail
+        cand = self.cand
+        trail.append((-1 - i, val))
+        trail.append((i, cand[i]))
+        self.cells[i] = val
+        cand[i] = 0
+        self.filled += 1
+        for u in (r, n + c, 2 * n + b):
+            if self.counts[u][val]:
+                self.conflicts += 1
+            self.counts[u][val] += 1
+        self.rows[r] |= bit
+        self.cols[c] |= bit
+        self.boxes[b] |= bit
+        for p in units.peers[i]:
+            if cand[p] & bit:
+                trail.append((p, cand[p]))
+                cand[p] &= ~bit
+
+    def eliminate(self, i, mask):
+        '''Remove the values in mask from the candidates of cell i'''
+        if self.cand[i] & mask:
+            self.trail.append((i, self.cand[i]))
+            self.cand[i] &= ~mask
+
+    def unset(self, i):
+        '''Remove the value of cell i from the unit masks and totals
+
+           The candidate masks are left alone, see undo() and clear()
+        '''
+        units = self.units
+        n = self.n
+        val = self.cells[i]
+        r, c, b = units.row[i], units.col[i], units.box[i]
+        bit = 1 << (val - 1)
+        self.cells[i] = None
+        self.filled -= 1
+        for u in (r, n + c, 2 * n + b):
+            self.counts[u][val] -= 1
+            if self.counts[u][val]:
+                self.conflicts -= 1
+        if not self.counts[r][val]:
+            self.rows[r] &= ~bit
+        if not self.counts[n + c][val]:
+            self.cols[c] &= ~bit
+        if not self.counts[2 * n + b][val]:
+            self.boxes[b] &= ~bit
+
+    def clear(self, r, c):
+        '''Clear a cell outside of the search, recomputing the candidates
+           of the cell and its peers from the unit masks'''
+        units = self.units
+        i = r * self.n + c
+        if self.cells[i] is None:
+            return
+
+        self.unset(i)
+        for p in [i] + units.peers[i]:
+            if self.cells[p] is None:
+                self.cand[p] = self.full & ~(
+                    self.rows[units.row[p]] | self.cols[units.col[p]]
+                    | self.boxes[units.box[p]])
+
+    def grid(self):
+        n = self.n
+        return [self.cells[r * n:(r + 1) * n] for r in range(n)]
+
+
+def check_line(line, n=None):
+    n = n or max_val()
+    if type(line) != list or len(line) != n:
         return False
 
     for a in line:
         if a is None:
             continue
-        if type(a) != int or a < min_val() or a > max_val():
+        if type(a) != int or a < min_val() or a > n:
             return False
         if len([x for x in line if x == a]) != 1:
             return False
@@ -35,31 +321,37 @@ def check_line(line):
 
 
 def check_row_col(puzzle):
-    if type(puzzle) != list or len(puzzle) != max_val():
+    if type(puzzle) != list or sudoku_size(puzzle) not in SIZES:
+        return False
+    n = max_val(puzzle)
+    if len(puzzle) != n:
         return False
 
-    for i in range(min_val() - 1, max_val()):
-        if not check_line(puzzle[i]):
+    for i in range(min_val() - 1, n):
+        if not check_line(puzzle[i], n):
             return False
         col = [row[i] for row in puzzle]
-        if not check_line(col):
+        if not check_line(col, n):
             return False
 
     return True
 
 
 def check_square(puzzle):
+    if TRACE:
+        TRACE.count('check_square')
     if not check_row_col(puzzle):
         return False
 
-    for r in range(min_val() - 1, max_val(), sudoku_size()):
-        for c in range(min_val() - 1, max_val(), sudoku_size()):
-            square = [row[c:sudoku_size() + c]
-                      for row in puzzle[r:sudoku_size() + r]]
+    size = sudoku_size(puzzle)
+    n = max_val(puzzle)
+    for r in range(min_val() - 1, n, size):
+        for c in range(min_val() - 1, n, size):
+            square = [row[c:size + c] for row in puzzle[r:size + r]]
             data = []
             for d in square:
                 data.extend(d)
-            if not check_line(data):
+            if not check_line(data, n):
                 return False
 
     return True
@@ -76,202 +368,990 @@ def check_solved(puzzle):
     return True
 
 
-def find_open_pos(puzzle):
-    open_pos = [0, 1, 1]
-    for r, row in enumerate(puzzle):
-        if len(set(row)) <= open_pos[0]:
+def find_branch_cell(board):
+    '''Open cell with the fewest candidates to guess at
+
+       Ties are broken by degree, the number of open peers, so the guess
+       constrains as much of the board as possible.  returns None if no
+       cell is open.
+    '''
+    if TRACE:
+        TRACE.count('find_branch_cell')
+    cand = board.cand
+    cells = board.cells
+    fewest = board.n + 1
+    best = []
+    for i, m in enumerate(cand):
+        if cells[i] is not None:
             continue
-        for c, val in enumerate(row):
-            if val is None:
-                open_pos = [len(set(row)), r, c]
-                break
+        k = m.bit_count()
+        if k < fewest:
+            fewest = k
+            best = [i]
+        elif k == fewest:
+            best.append(i)
+    if len(best) <= 1:
+        return best[0] if best else None
+
+    peers = board.units.peers
+    return max(best, key=lambda i: sum(
+        1 for p in peers[i] if cells[p] is None))
+
+
+def ascending_values(board, i):
+    return bits(board.cand[i])
+
 
-    return open_pos[1:]
+def descending_values(board, i):
+    return bits(board.cand[i])[::-1]
 
 
-def find_num(puzzle):
-    isolated = find_isolated_row_value(puzzle)
+def least_constraining_values(board, i):
+    '''Candidates of cell i, those ruling out the fewest peer
+       candidates first'''
+    cand = board.cand
+    peers = board.units.peers[i]
+    return sorted(bits(cand[i]), key=lambda v: sum(
+        1 for p in peers if cand[p] & (1 << (v - 1))))
+
+
+# Orders to try the candidates of a guessed cell in
+VALUE_ORDERS = {
+    'ascending': ascending_values,
+    'descending': descending_values,
+    'lcv': least_constraining_values,
+}
+
+
+def find_num(board):
+    '''Find a value that logic alone places, as (row, col, value, rule),
+       or None'''
+    if TRACE:
+        TRACE.count('find_num')
+    isolated = find_isolated_row_value(board)
     if isolated:
-        return isolated
+        return isolated + ('isolated row value',)
 
-    isolated = find_isolated_col_value(puzzle)
+    isolated = find_isolated_col_value(board)
     if isolated:
-        return isolated
-
-    return find_num2(puzzle)
-
-
-def find_isolated_row_value(puzzle):
-    '''Find values that have only one position in a ow'''
-    for i in range(min_val() - 1, max_val()):
-        row = puzzle[i]
-        row_missing = list(
-            set(range(min_val(), max_val() + 1)) - set(row))
-        for j in sorted(row_missing):
-            test_j = []
-            for c in range(len(row)):
-                if puzzle[i][c] is None:
-                    new_puzzle = copy(puzzle)
-                    new_puzzle[i][c] = j
-                    if check_square(new_puzzle):
-                        test_j.append((i, c, j))
-            if len(test_j) == 1:
-                return test_j[0]
+        return isolated + ('isolated col value',)
+
+    return find_num2(board)
+
+
+def hidden_single(board, unit, used):
+    '''Find the lowest value that has only one position in unit'''
+    once = 0
+    twice = 0
+    for i in unit:
+        m = board.cand[i]
+        twice |= once & m
+        once |= m
+    single = once & ~twice & ~used
+    if not single:
+        return None
+
+    bit = single & -single
+    for i in unit:
+        if board.cand[i] & bit:
+            return (board.units.row[i], board.units.col[i], bit.bit_length())
+
+    return None
+
+
+def find_isolated_row_value(board):
+    '''Find values that have only one position in a row'''
+    if TRACE:
+        TRACE.count('find_isolated_row_value')
+    units = board.units
+    for i in range(board.n):
+        found = hidden_single(board, units.row_cells[i], board.rows[i])
+        if found:
+            return found
 
     return None
 
 
-def find_isolated_col_value(puzzle):
+def find_isolated_col_value(board):
     '''Find values that have only one position in row or column'''
-    for i in range(min_val() - 1, max_val()):
-        col = [row[i] for row in puzzle]
-        col_missing = list(
-            set(range(min_val(), max_val() + 1)) - set(col))
-        for j in sorted(col_missing):
-            test_j = []
-            for r in range(len(col)):
-                if puzzle[r][i] is None:
-                    new_puzzle = copy(puzzle)
-                    new_puzzle[r][i] = j
-                    if check_square(new_puzzle):
-                        test_j.append((r, i, j))
-            if len(test_j) == 1:
-                return test_j[0]
-
-        row = puzzle[i]
-        row_missing = list(
-            set(range(min_val(), max_val() + 1)) - set(row))
-        for j in sorted(row_missing):
-            test_j = []
-            for c in range(len(row)):
-                if puzzle[i][c] is None:
-                    new_puzzle = copy(puzzle)
-                    new_puzzle[i][c] = j
-                    if check_square(new_puzzle):
-                        test_j.append((i, c, j))
-            if len(test_j) == 1:
-                return test_j[0]
+    if TRACE:
+        TRACE.count('find_isolated_col_value')
+    units = board.units
+    for i in range(board.n):
+        found = hidden_single(board, units.col_cells[i], board.cols[i])
+        if found:
+            return found
+
+        found = hidden_single(board, units.row_cells[i], board.rows[i])
+        if found:
+            return found
 
     return None
 
 
-def find_num2(puzzle):
-    for r in range(min_val() - 1, max_val(), sudoku_size()):
-        for c in range(min_val() - 1, max_val(), sudoku_size()):
-            sq_rows = puzzle[r:sudoku_size() + r]
-            square = [row[c:sudoku_size() + c] for row in sq_rows]
-            data = []
-            for d in square:
-                data.extend(d)
+def find_num2(board):
+    '''Find values that have only one position in a square,
+       or cells that have only one possible value'''
+    if TRACE:
+        TRACE.count('find_num2')
+    units = board.units
+    for b in range(board.n):
+        found = hidden_single(board, units.box_cells[b], board.boxes[b])
+        if found:
+            return found + ('isolated box value',)
+
+    for i, m in enumerate(board.cand):
+        if m and not m & (m - 1):
+            r, c, num = units.row[i], units.col[i], m.bit_length()
+            if TRACE:
+                TRACE.event('rule', r, c, num, 'single value')
+            return (r, c, num, 'single value')
 
-            square_missing = list(
-                set(range(min_val(), max_val() + 1)) - set(data))
-            for i in sorted(square_missing):
-                test_i = []
-                for r1 in range(r, r + sudoku_size()):
-                    for c1 in range(c, c + sudoku_size()):
-                        if puzzle[r1][c1] is None:
-                            new_puzzle = copy(puzzle)
-                            new_puzzle[r1][c1] = i
-                            if check_square(new_puzzle):
-                                test_i.append((r1, c1, i))
-                if len(test_i) == 1:
-                    return test_i[0]
-
-            for r1, row in enumerate(sq_rows):
-                other_rows = [sq_rows[i] for i in
-                              range(sudoku_size()) if i != r1]
-                row_intersect = set(other_rows[0]) - set([None])
-                for o in other_rows:
-                    row_intersect = row_intersect & set(o)
-                for c1 in range(c, c + sudoku_size()):
-                    if row[c1] is not None:
-                        continue
-                    all_but_row = list(
-                        set(range(min_val(), max_val() + 1))
-                        - set(row))
-                    if len(all_but_row) == 1:
-                        num = all_but_row[0]
-                        if num not in data:
-                            print(f'all but row: row {r+r1+1} col {c1+1} to {num}')
-                            return (r + r1, c1, num)
-
-                    other_minus_square = list(row_intersect - set(data))
-                    if (len(set(square[r1])) == sudoku_size()
-                            and len(other_minus_square) == 1):
-                        num = other_minus_square[0]
-                        return (r + r1, c1, num)
-
-                    col = [p[c1] for p in puzzle]
-                    all_but_col = list(
-                        set(range(min_val(), max_val() + 1))
-                        - set(col))
-                    if len(all_but_col) == 1:
-                        num = all_but_col[0]
-                        if num not in data:
-                            print(f'all but col: row {r+r1+1} col {c1+1} to {num}')
-                            return (r + r1, c1, num)
-
-                    other_cols = [[p[i] for p in puzzle] for i in
-                                  range(c, c + sudoku_size()) if i != c1]
-                    col_intersect = set(other_cols[0]) - set([None])
-                    for o in other_cols:
-                        col_intersect = col_intersect & set(o)
-                    other_minus_square = list(col_intersect - set(data))
-                    if (len(set([s[c1-c] for s in square])) == sudoku_size()
-                            and len(other_minus_square) == 1):
-                        num = other_minus_square[0]
-                        return (r + r1, c1, num)
-
-                    if len(row_intersect & col_intersect) == 1:
-                        num = list(row_intersect & col_intersect)[0]
-                        if num not in data:
-                            return (r + r1, c1, num)
     return None
 
 
-def try_solve(puzzle):
-    if check_solved(puzzle):
-        return puzzle
+def set_value(board, i, val, rule):
+    r, c = board.units.row[i], board.units.col[i]
+    if TRACE:
+        TRACE.event('place', r, c, val, rule)
+    board.place(r, c, val)
+
+
+def bits(mask):
+    '''Values (1 based) of the bits set in mask'''
+    values = []
+    while mask:
+        bit = mask & -mask
+        values.append(bit.bit_length())
+        mask ^= bit
+    return values
+
+
+def naked_singles(board):
+    '''Set cells that have only one possible value'''
+    placed = 0
+    cand = board.cand
+    for i, val in enumerate(board.cells):
+        if val is not None:
+            continue
+        m = cand[i]
+        if not m:
+            return None
+        if not m & (m - 1):
+            set_value(board, i, m.bit_length(), 'naked_single')
+            placed += 1
+    return placed, 0
+
+
+def hidden_singles(board):
+    '''Set values that have only one possible position in a unit'''
+    placed = 0
+    cand = board.cand
+    cells = board.cells
+    for unit in board.units.all_units:
+        once = 0
+        twice = 0
+        used = 0
+        for i in unit:
+            m = cand[i]
+            twice |= once & m
+            once |= m
+            if cells[i] is not None:
+                used |= 1 << (cells[i] - 1)
+        if (once | used) != board.full:
+            return None
+        single = once & ~twice
+        for i in unit:
+            if cand[i] & single:
+                val = (cand[i] & single).bit_length()
+                set_value(board, i, val, 'hidden_single')
+                placed += 1
+    return placed, 0
+
+
+def naked_subsets(board, k):
+    '''k cells of a unit with only k values between them:
+       remove those values from the rest of the unit'''
+    eliminated = 0
+    cand = board.cand
+    for unit in board.units.all_units:
+        open_cells = [i for i in unit if cand[i]]
+        if len(open_cells) <= k:
+            continue
+        small = [i for i in open_cells if cand[i].bit_count() <= k]
+        for subset in itertools.combinations(small, k):
+            mask = 0
+            for i in subset:
+                mask |= cand[i]
+            if mask.bit_count() != k:
+                continue
+            for i in open_cells:
+                if i not in subset and cand[i] & mask:
+                    eliminated += (cand[i] & mask).bit_count()
+                    board.eliminate(i, mask)
+    return 0, eliminated
+
+
+def hidden_subsets(board, k):
+    '''k values with only k cells of a unit between them:
+       remove the other values from those cells'''
+    eliminated = 0
+    cand = board.cand
+    for unit in board.units.all_units:
+        positions = [0] * board.n
+        for j, i in enumerate(unit):
+            for v in bits(cand[i]):
+                positions[v - 1] |= 1 << j
+        values = [v for v in range(board.n)
+                  if 2 <= positions[v].bit_count() <= k]
+        for subset in itertools.combinations(values, k):
+            where = 0
+            keep = 0
+            for v in subset:
+                where |= positions[v]
+                keep |= 1 << v
+            if where.bit_count() != k:
+                continue
+            for j in bits(where):
+                i = unit[j - 1]
+                if cand[i] & ~keep:
+                    eliminated += (cand[i] & ~keep).bit_count()
+                    board.eliminate(i, ~keep & board.full)
+    return 0, eliminated
+
+
+def eliminate_outside(board, value_cells, line, bit):
+    '''Remove bit from the cells of line not in value_cells'''
+    eliminated = 0
+    for i in line:
+        if i not in value_cells and board.cand[i] & bit:
+            board.eliminate(i, bit)
+            eliminated += 1
+    return eliminated
+
+
+def pointing(board):
+    '''A value that is only in one row (or col) of a box:
+       remove it from the rest of the row (or col)'''
+    eliminated = 0
+    units = board.units
+    cand = board.cand
+    for box in units.box_cells:
+        for v in range(board.n):
+            bit = 1 << v
+            value_cells = [i for i in box if cand[i] & bit]
+            if len(value_cells) < 2:
+                continue
+            rows = set(units.row[i] for i in value_cells)
+            if len(rows) == 1:
+                eliminated += eliminate_outside(
+                    board, value_cells, units.row_cells[rows.pop()], bit)
+            cols = set(units.col[i] for i in value_cells)
+            if len(cols) == 1:
+                eliminated += eliminate_outside(
+                    board, value_cells, units.col_cells[cols.pop()], bit)
+    return 0, eliminated
+
+
+def box_line(board):
+    '''A value that is only in one box of a row (or col):
+       remove it from the rest of the box'''
+    eliminated = 0
+    units = board.units
+    cand = board.cand
+    for line in units.row_cells + units.col_cells:
+        for v in range(board.n):
+            bit = 1 << v
+            value_cells = [i for i in line if cand[i] & bit]
+            if len(value_cells) < 2:
+                continue
+            boxes = set(units.box[i] for i in value_cells)
+            if len(boxes) == 1:
+                eliminated += eliminate_outside(
+                    board, value_cells, units.box_cells[boxes.pop()], bit)
+    return 0, eliminated
+
+
+# Propagation techniques, cheapest first.  Each takes a board, makes what
+# placements and eliminations it can, and returns (placed, eliminated),
+# or None if it finds the board has no solution.
+TECHNIQUES = {
+    'naked_single': naked_singles,
+    'hidden_single': hidden_singles,
+    'naked_pair': lambda board: naked_subsets(board, 2),
+    'hidden_pair': lambda board: hidden_subsets(board, 2),
+    'pointing': pointing,
+    'box_line': box_line,
+    'naked_triple': lambda board: naked_subsets(board, 3),
+    'hidden_triple': lambda board: hidden_subsets(board, 3),
+}
+
+
+class TechniqueStats:
+    '''Counters for one propagation technique'''
+
+    def __init__(self):
+        self.calls = 0
+        self.placed = 0
+        self.eliminated = 0
+        self.seconds = 0.0
+
+
+class SolveStats:
+    '''Search counters, and counters for each propagation technique,
+       across any number of solves
+
+       nodes is the number of boards propagated: the starting board and
+       one for each guess.  backtracks is the number of those boards that
+       turned out to have no solution.
+    '''
+
+    def __init__(self):
+        self.techniques = {name: TechniqueStats() for name in TECHNIQUES}
+        self.nodes = 0
+        self.guesses = 0
+        self.backtracks = 0
+
+    def report(self):
+        lines = [f'nodes {self.nodes}, guesses {self.guesses}, '
+                 f'backtracks {self.backtracks}',
+                 f'{"technique":<14} {"calls":>8} {"placed":>8} '
+                 f'{"eliminated":>10} {"ms":>10}']
+        for name, s in self.techniques.items():
+            lines.append(f'{name:<14} {s.calls:>8} {s.placed:>8} '
+                         f'{s.eliminated:>10} {s.seconds * 1000:>10.2f}')
+        return '\n'.join(lines)
+
+
+def propagate(board, techniques=None, stats=None):
+    '''Run the propagation techniques on board until none of them
+       makes any more progress
+
+       techniques is a list of names from TECHNIQUES (default all of them),
+       they are always run in the order of TECHNIQUES, and after any
+       progress propagation starts again from the cheapest technique.
+       If stats is given, the counters for each technique are updated.
+
+       returns False if the board is found to have no solution
+    '''
+    if techniques is not None and not set(techniques) <= TECHNIQUES.keys():
+        unknown = sorted(set(techniques) - TECHNIQUES.keys())
+        raise ValueError(f'unknown techniques {unknown}, '
+                         f'use some of {list(TECHNIQUES)}')
+    names = [name for name in TECHNIQUES
+             if techniques is None or name in techniques]
+    progress = True
+    while progress and board.valid():
+        progress = False
+        for name in names:
+            if stats:
+                start = time.perf_counter()
+            result = TECHNIQUES[name](board)
+            if stats:
+                s = stats.techniques[name]
+                s.calls += 1
+                s.seconds += time.perf_counter() - start
+                if result:
+                    s.placed += result[0]
+                    s.eliminated += result[1]
+            if result is None:
+                return False
+            if result[0] or result[1]:
+                if TRACE:
+                    TRACE.event('rule', rule=name)
+                progress = True
+                break
+    return board.valid()
+
+
+class Budget:
+    '''Limits on a search: a number of nodes, and seconds of wall clock
+       counted from when the Budget is made
+
+       search() spends one node of it per board propagated, and stops
+       when it is used up, setting exhausted.
+    '''
+
+    def __init__(self, nodes=None, seconds=None):
+        self.nodes = nodes
+        self.deadline = None if seconds is None else time.monotonic() + seconds
+        self.used = 0
+        self.exhausted = False
+
+    def spend(self):
+        '''Count a node, returning False if the budget is used up'''
+        self.used += 1
+        if ((self.nodes is not None and self.used > self.nodes) or
+                (self.deadline is not None and
+                 time.monotonic() > self.deadline)):
+            self.exhausted = True
+        return not self.exhausted
+
+
+def search(board, techniques=None, stats=None, value_order='ascending',
+           budget=None, propagated=False):
+    '''Generate each solution of board, solving it in place
+
+       Before each guess, the propagation techniques are run to a fixpoint,
+       see propagate().  The guess is made at the cell with the fewest
+       candidates (see find_branch_cell), trying only its candidates in
+       the order given by value_order, a name from VALUE_ORDERS.
+
+       The search is iterative: each guess point is pushed on a stack with
+       the trail mark to undo to before trying its next value, so no grids
+       are copied and deep searches do not hit the recursion limit.
+
+       board itself is yielded for each solution, and is changed again
+       when the search resumes, so copy the grid before asking for more.
+       If budget is given, the search stops early when it is used up.
+       If propagated, board has already been propagated by the caller, so
+       it is not propagated, counted or charged to budget again.
+    '''
+    order = VALUE_ORDERS[value_order]
+    guesses = []
+    while True:
+        if propagated:
+            ok = board.valid()
+            propagated = False
+        else:
+            if budget and not budget.spend():
+                return
+            if stats:
+                stats.nodes += 1
+            ok = board.valid() and propagate(board, techniques, stats)
+        if ok:
+            if board.solved():
+                yield board
+            else:
+                i = find_branch_cell(board)
+                r, c = board.units.row[i], board.units.col[i]
+                guesses.append((board.mark(), r, c, iter(order(board, i))))
+        else:
+            if stats:
+                stats.backtracks += 1
+            if TRACE:
+                TRACE.event('backtrack')
+
+        # Try the next value of the latest guess point, dropping
+        # guess points that have no values left
+        while guesses:
+            mark, r, c, values = guesses[-1]
+            board.undo(mark)
+            i = next(values, None)
+            if i is not None:
+                if TRACE:
+                    TRACE.event('guess', r, c, i)
+                if stats:
+                    stats.guesses += 1
+                board.place(r, c, i)
+                break
+            guesses.pop()
+        else:
+            return
+
+
+def solve_board(board, techniques=None, stats=None, value_order='ascending',
+                budget=None, propagated=False):
+    '''Solve board in place, returning it when solved or None
+
+       see search() for the options
+    '''
+    for solved in search(board, techniques, stats, value_order, budget,
+                         propagated):
+        return solved
+    return None
+
+
+def try_solve(puzzle, techniques=None, stats=None, value_order='ascending'):
+    '''Solve puzzle, returning the solved grid or None
+
+       The full board checks are only run on the input and the solution,
+       the search itself uses the running totals kept by Board.
+       The options are passed on to search(), stats is a SolveStats.
+    '''
     if not check_square(puzzle):
         return None
 
-    new_puzzle = copy(puzzle)
-    found = find_num(puzzle)
-    if found:
-        print(f'setting row {found[0] + 1} col {found[1] + 1} to {found[2]}')
-        new_puzzle[found[0]][found[1]] = found[2]
-        return try_solve(new_puzzle)
-    (r, c) = find_open_pos(new_puzzle)
-    row_missing = list(
-        set(range(min_val(), max_val() + 1)) - set(puzzle[r]))
-    for i in sorted(row_missing):
-        new_puzzle[r][c] = i
-        print(f'guessing row {r + 1} col {c + 1} as {i}')
-        check = try_solve(new_puzzle)
-        if check:
-            return check
+    board = solve_board(Board(puzzle), techniques, stats, value_order)
+    if board is None:
+        return None
+    soln = board.grid()
+    return soln if check_solved(soln) else None
 
-    return None
+
+class SolveResult:
+    '''Outcome of solve_within
+
+       status is one of:
+         solved      grid is the solution
+         unsolvable  the puzzle has no solution
+         invalid     the puzzle breaks the rules as given, grid is None
+         budget      the budget ran out, grid is the puzzle with what
+                     propagation places before any guess
+       stats is the SolveStats of the search and seconds its wall clock
+    '''
+
+    def __init__(self, status, grid, stats, seconds):
+        self.status = status
+        self.grid = grid
+        self.stats = stats
+        self.seconds = seconds
+
+    def __repr__(self):
+        return (f'SolveResult({self.status}, nodes {self.stats.nodes}, '
+                f'{self.seconds * 1000:.1f} ms)')
+
+
+def solve_within(puzzle, nodes=None, seconds=None, techniques=None,
+                 stats=None, value_order='ascending'):
+    '''Solve puzzle with at most nodes search nodes and seconds of wall
+       clock, returning a SolveResult
+
+       Unlike try_solve, running out of budget is told apart from having
+       no solution, and the result still has the grid that propagation
+       reached, which is all sound, and the search counters.
+    '''
+    start = time.monotonic()
+    budget = Budget(nodes, seconds)
+    stats = stats or SolveStats()
+
+    def result(status, grid):
+        return SolveResult(status, grid, stats, time.monotonic() - start)
+
+    if not check_square(puzzle):
+        return result('invalid', None)
+
+    # The root is always propagated, so a puzzle solved by propagation
+    # alone is solved whatever the budget
+    board = Board(puzzle)
+    budget.spend()
+    stats.nodes += 1
+    if not (board.valid() and propagate(board, techniques, stats)):
+        return result('unsolvable', board.grid())
+    partial = board.grid()
+    if board.solved():
+        return result('solved' if check_solved(partial) else 'unsolvable',
+                      partial)
+    solved = solve_board(board, techniques, stats, value_order, budget,
+                         propagated=True)
+    if solved is not None:
+        soln = solved.grid()
+        return result('solved' if check_solved(soln) else 'unsolvable', soln)
+    if budget.exhausted:
+        return result('budget', partial)
+    return result('unsolvable', partial)
+
+
+def solve_steps(puzzle):
+    '''Generate the steps of solving puzzle one at a time, for hints
+
+       Each step is (row, col, value, rule), with row and col from 0, and
+       is found on the board left by the steps before it, see find_num.
+       Only when logic alone finds nothing is the puzzle solved, and the
+       step is then the value of the solution at the cell search would
+       guess at, with the rule 'guess'.  So taking only the first step
+       costs one scan of the board, not a solve.
+
+       The steps stop early if the puzzle turns out to have no solution.
+    '''
+    if not check_square(puzzle):
+        return
+
+    board = Board(puzzle)
+    solution = None
+    while board.valid() and not board.solved():
+        step = find_num(board)
+        if step is None:
+            if solution is None:
+                solved = solve_board(board.copy())
+                if solved is None:
+                    return
+                solution = solved.cells
+            i = find_branch_cell(board)
+            step = (board.units.row[i], board.units.col[i], solution[i],
+                    'guess')
+        r, c, val, rule = step
+        if TRACE:
+            TRACE.event('place', r, c, val, rule)
+        board.place(r, c, val)
+        yield step
+
+
+def hint(puzzle):
+    '''Next step of solve_steps, or None if there is none'''
+    return next(solve_steps(puzzle), None)
+
+
+def count_solutions(puzzle, limit=2, techniques=None, stats=None):
+    '''Count the solutions of puzzle, stopping at limit
+
+       The search goes on past the first solution with the same
+       propagation as try_solve, so with the default limit of 2 checking
+       that a puzzle has a unique solution costs about one solve.
+       returns 0 for an invalid puzzle
+    '''
+    if not check_square(puzzle):
+        return 0
+
+    count = 0
+    for board in search(Board(puzzle), techniques, stats):
+        count += 1
+        if count >= limit:
+            break
+    return count
+
+
+def has_unique_solution(puzzle, techniques=None, stats=None):
+    return count_solutions(puzzle, 2, techniques, stats) == 1
+
+
+def exact_cover_rows(board):
+    '''Exact cover rows for each (cell, value) still possible on board
+
+       Columns are: cell filled, value in row, value in col, value in box
+    '''
+    units = board.units
+    n = board.n
+    cells = n * n
+    rows = []
+    choices = []
+    for i, val in enumerate(board.cells):
+        values = ([val] if val is not None else
+                  [v for v in range(min_val(), n + 1)
+                   if board.cand[i] & (1 << (v - 1))])
+        for v in values:
+            rows.append([i,
+                         cells + units.row[i] * n + v - 1,
+                         2 * cells + units.col[i] * n + v - 1,
+                         3 * cells + units.box[i] * n + v - 1])
+            choices.append((i, v))
+    return 4 * cells, rows, choices
+
+
+def solve_dlx(puzzle, stats=None):
+    '''Solve puzzle as an exact cover problem with dancing links
+
+       returns the solved grid or None, the same as try_solve.
+       If stats is given, its nodes and guesses are updated.
+    '''
+    if not check_square(puzzle):
+        return None
+
+    board = Board(puzzle)
+    num_columns, rows, choices = exact_cover_rows(board)
+    cover = dlx.ExactCover(num_columns, rows)
+    solution = dlx.solve_exact_cover(num_columns, rows, cover)
+    if stats:
+        stats.nodes += cover.nodes
+        stats.guesses += cover.guesses
+    if solution is None:
+        return None
+    for r in solution:
+        i, v = choices[r]
+        board.cells[i] = v
+    soln = board.grid()
+    return soln if check_solved(soln) else None
+
+
+def split_branches(board, count, techniques=None, stats=None,
+                   value_order='ascending'):
+    '''Guess breadth first from board until there are count open boards
+
+       Each guess is propagated, and boards found to have no solution are
+       dropped.  returns (board, []) if a guess solves the board,
+       otherwise (None, open boards), in the order search() would try them
+    '''
+    frontier = collections.deque([board])
+    while frontier and len(frontier) < count:
+        parent = frontier.popleft()
+        i = find_branch_cell(parent)
+        r, c = parent.units.row[i], parent.units.col[i]
+        for val in VALUE_ORDERS[value_order](parent, i):
+            child = parent.copy()
+            child.place(r, c, val)
+            if stats:
+                stats.nodes += 1
+                stats.guesses += 1
+            if not (child.valid() and propagate(child, techniques, stats)):
+                if stats:
+                    stats.backtracks += 1
+                continue
+            if child.solved():
+                return child, []
+            frontier.append(child)
+    return None, list(frontier)
+
+
+def solve_branches(conn, tasks):
+    '''Solve branch grids in a worker process, sending each result on conn
+
+       A result is the solution or None, and the search counters, so the
+       caller can add them up for the branches that finished.
+    '''
+    quiet_worker()
+    for grid, techniques, value_order in tasks:
+        stats = SolveStats()
+        soln = try_solve(grid, techniques, stats, value_order)
+        conn.send((soln, stats.nodes, stats.guesses, stats.backtracks))
+    conn.close()
+
+
+def solve_parallel(puzzle, processes=None, techniques=None, stats=None,
+                   value_order='ascending'):
+    '''Solve puzzle, searching the branches near the top of the tree in
+       parallel worker processes
+
+       The board is propagated first, and the guesses at the top are
+       expanded until there are a few open boards per worker.  Puzzles
+       solved on the way never start a worker, so easy puzzles cost the
+       same as try_solve.  The open boards are dealt out to the workers
+       in search order, and the first solution found stops the workers,
+       cancelling the other branches.  returns the solved grid or None,
+       as try_solve.
+
+       In a daemon process, such as a worker of solve_stream, which may
+       not start processes of its own, this is the same as try_solve.
+    '''
+    if multiprocessing.current_process().daemon:
+        return try_solve(puzzle, techniques, stats, value_order)
+    if not check_square(puzzle):
+        return None
+
+    board = Board(puzzle)
+    if stats:
+        stats.nodes += 1
+    if not (board.valid() and propagate(board, techniques, stats)):
+        return None
+    processes = processes or multiprocessing.cpu_count()
+    if board.solved():
+        solved = board
+    else:
+        solved, branches = split_branches(board, 2 * processes,
+                                          techniques, stats, value_order)
+    if solved is not None:
+        soln = solved.grid()
+        return soln if check_solved(soln) else None
+
+    tasks = [(b.grid(), techniques, value_order) for b in branches]
+    workers = []
+    for k in range(min(processes, len(tasks))):
+        conn, child = multiprocessing.Pipe(duplex=False)
+        process = multiprocessing.Process(
+            target=solve_branches, args=(child, tasks[k::processes]),
+            daemon=True)
+        process.start()
+        child.close()
+        workers.append((process, conn))
+
+    soln = None
+    try:
+        pending = len(tasks)
+        conns = [conn for process, conn in workers]
+        while pending and soln is None:
+            for conn in multiprocessing.connection.wait(conns):
+                try:
+                    found, nodes, guesses, backtracks = conn.recv()
+                except EOFError:
+                    conns.remove(conn)
+                    continue
+                pending -= 1
+                if stats:
+                    stats.nodes += nodes
+                    stats.guesses += guesses
+                    stats.backtracks += backtracks
+                if found is not None:
+                    soln = found
+                    break
+            if not conns:
+                break
+    finally:
+        # Stops the workers still searching other branches
+        for process, conn in workers:
+            process.terminate()
+            process.join()
+            conn.close()
+    return soln
+
+
+ENGINES = {
+    'search': try_solve,
+    'dlx': solve_dlx,
+    'parallel': solve_parallel,
+}
+
+
+def solve(puzzle, engine='search', **options):
+    '''Solve puzzle with the named engine, see ENGINES
+
+       options are passed on to the engine, e.g. techniques for try_solve
+    '''
+    if engine not in ENGINES:
+        raise ValueError(f'unknown engine {engine}, use one of {sorted(ENGINES)}')
+    soln = ENGINES[engine](puzzle, **options)
+    if TRACE:
+        TRACE.solved(engine, soln)
+    return soln
+
+
+def accepted_options(function, options):
+    '''The options that function takes, and the names of the others'''
+    params = inspect.signature(function).parameters
+    return ({k: v for k, v in options.items() if k in params},
+            sorted(k for k in options if k not in params))
+
+
+def parse_line(line):
+    '''Parse a puzzle written on one line, row by row
+
+       The line has one character per cell, from VALUE_CHARS, so a 9x9
+       puzzle has 81 and a 16x16 puzzle 256.  Empty cells are 0 or '.',
+       returns None if the line is not a puzzle
+    '''
+    line = line.strip()
+    sizes = [s for s in SIZES if len(line) == s ** 4]
+    if not sizes:
+        return None
+    n = sizes[0] * sizes[0]
+    values = []
+    for e in line.upper():
+        if e in '0.':
+            values.append(None)
+        elif e in VALUE_CHARS[:n]:
+            values.append(VALUE_CHARS.index(e) + 1)
+        else:
+            return None
+    return [values[r * n:(r + 1) * n] for r in range(n)]
+
+
+def format_line(puzzle):
+    return ''.join(['.' if e is None else VALUE_CHARS[e - 1]
+                    for r in puzzle for e in r])
+
+
+def quiet_worker():
+    '''Pool initializer: workers do not trace, their events would be lost'''
+    global TRACE
+    TRACE = None
+
+
+def solve_chunk(task):
+    '''Solve a list of (index, line) puzzles in a worker process'''
+    engine, chunk = task
+    results = []
+    for index, line in chunk:
+        puzzle = parse_line(line)
+        soln = solve(puzzle, engine) if puzzle is not None else None
+        results.append((index, format_line(soln) if soln else str(None)))
+    return results
+
+
+def solve_stream(lines, out, engine='search', processes=None,
+                 chunksize=16, max_in_flight=None, ordered=True):
+    '''Solve puzzles from lines, one per line, with a worker pool
+
+       Puzzles are sent to the workers in chunks of chunksize, and at most
+       max_in_flight chunks (default 4 per worker) are queued or being
+       solved at any time, so a large input is never read into memory.
+
+       If ordered, each solution is written to out in input order as soon
+       as it and all before it are done.  Otherwise solutions are written
+       as they finish, prefixed by the index of the puzzle in the input.
+       Puzzles that cannot be solved are written as None.
+    '''
+    processes = processes or multiprocessing.cpu_count()
+    in_flight = threading.BoundedSemaphore(max_in_flight or 4 * processes)
+
+    def tasks():
+        chunk = []
+        for index, line in enumerate(l for l in lines if l.strip()):
+            chunk.append((index, line))
+            if len(chunk) >= chunksize:
+                in_flight.acquire()
+                yield (engine, chunk)
+                chunk = []
+        if chunk:
+            in_flight.acquire()
+            yield (engine, chunk)
+
+    with multiprocessing.Pool(processes, initializer=quiet_worker) as pool:
+        results = (pool.imap(solve_chunk, tasks()) if ordered
+                   else pool.imap_unordered(solve_chunk, tasks()))
+        for chunk in results:
+            in_flight.release()
+            for index, soln in chunk:
+                out.write(f'{soln}\n' if ordered else f'{index} {soln}\n')
+
+
+def arg_value(name, default=None):
+    '''Value of a --name=value command line flag'''
+    for arg in sys.argv:
+        if arg.startswith(f'--{name}='):
+            return arg.split('=', 1)[1]
+    return default
 
 
 if __name__ == '__main__':
+    engine = 'dlx' if '--dlx' in sys.argv else 'search'
+    if '--parallel' in sys.argv:
+        engine = 'parallel'
+    if '--batch' in sys.argv:
+        processes = arg_value('processes')
+        solve_stream(sys.stdin, sys.stdout, engine,
+                     processes=int(processes) if processes else None,
+                     ordered='--unordered' not in sys.argv)
+        sys.exit(0)
+
     raw = sys.stdin.read()
     puzzle = [[(int(e) if e != '0' else None) for e in r.split()]
               for r in raw.strip().split('\n')]
 
-    for i, row in enumerate(p):
-        if i in [3, 6]:
+    for i, row in enumerate(puzzle):
+        if i and i % sudoku_size(puzzle) == 0:
             print('')
         print(str(row))
+    options = {}
+    if arg_value('techniques') is not None:
+        options['techniques'] = arg_value('techniques').split(',')
+    if arg_value('value-order') is not None:
+        options['value_order'] = arg_value('value-order')
+    if engine == 'parallel' and arg_value('processes') is not None:
+        options['processes'] = int(arg_value('processes'))
+    if '--stats' in sys.argv:
+        options['stats'] = SolveStats()
+    if '--trace' in sys.argv:
+        TRACE = Tracer(int(arg_value('trace-size', 10000)))
+    if '--steps' in sys.argv:
+        for r, c, val, rule in solve_steps(puzzle):
+            print(f'row {r + 1} col {c + 1} to {val} ({rule})')
+        sys.exit(0)
+    max_nodes = arg_value('max-nodes')
+    max_seconds = arg_value('max-seconds')
     print(f'Start at {datetime.datetime.now()}')
-    soln = try_solve(p)
+    # Search options are only passed to solvers that take them
+    solver = solve_within if max_nodes or max_seconds else ENGINES[engine]
+    options, ignored = accepted_options(solver, options)
+    if ignored:
+        print(f'ignoring {", ".join(ignored)}, not options of '
+              f'{solver.__name__}', file=sys.stderr)
+    if max_nodes or max_seconds:
+        result = solve_within(puzzle, int(max_nodes) if max_nodes else None,
+                              float(max_seconds) if max_seconds else None,
+                              **options)
+        print(result)
+        soln = result.grid
+    else:
+        soln = solve(puzzle, engine, **options)
     print(f'Stop at {datetime.datetime.now()}')
+    if '--stats' in sys.argv:
+        print(options['stats'].report())
+    if TRACE:
+        print(TRACE.format_events())
+        print(TRACE.profile())
     if type(soln) != list:
         print(str(soln) + '\n\n')
-    else
+    else:
         for i, row in enumerate(soln):
-            if i in [3, 6]:
+            if i and i % sudoku_size(puzzle) == 0:
                 print('')
             print(str(row))
         print('\n')
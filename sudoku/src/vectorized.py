@@ -0,0 +1,215 @@
+'''
+Vectorized batch validation and propagation
+
+This holds N puzzles of the same size as one (N, n, n) NumPy array, with
+0 for an empty cell, and validates them and propagates naked and hidden
+singles on all of them at once.  A batch of mixed sizes is held as one
+array per size.  Only the puzzles that are left open
+after that are passed to the search one at a time, which suits bulk
+ingest where most puzzles are easy.
+
+This needs NumPy, unlike the rest of the solver.
+
+To run, use the following command:
+  python3 vectorized.py < puzzles.txt
+
+It reads one puzzle per line in the 81 character format, or the format
+of another size as sudoku.py --batch does, and writes the solutions in
+order, with counts of how the puzzles were solved at the end
+'''
+
+import sys
+
+import numpy as np
+
+import sudoku
+
+
+def to_array(puzzles):
+    '''(N, n, n) array of puzzles, all of the same size'''
+    return np.array([[[0 if val is None else val for val in row]
+                      for row in puzzle] for puzzle in puzzles],
+                    dtype=np.int32)
+
+
+def from_array(boards):
+    return [[[None if val == 0 else int(val) for val in row]
+             for row in board] for board in boards]
+
+
+def box_view(a, size):
+    '''View of (N, n, n) as (N, size, size, size, size), with the box row,
+       row in box, box col and col in box as axes 1 to 4'''
+    return a.reshape((a.shape[0], size, size, size, size))
+
+
+def popcount(a):
+    '''Number of bits set in each element of an int32 array'''
+    a = a - ((a >> 1) & 0x55555555)
+    a = (a & 0x33333333) + ((a >> 2) & 0x33333333)
+    a = (a + (a >> 4)) & 0x0F0F0F0F
+    return (a * 0x01010101) >> 24
+
+
+def spread_boxes(a, size):
+    '''(N, n) values per box to (N, n, n) values per cell'''
+    a = a.reshape(-1, size, size)
+    return np.repeat(np.repeat(a, size, axis=1), size, axis=2)
+
+
+def unit_masks(bits, size):
+    '''OR of bits over each row, col and box, each broadcastable to
+       bits'''
+    rows = np.bitwise_or.reduce(bits, axis=2)[:, :, None]
+    cols = np.bitwise_or.reduce(bits, axis=1)[:, None, :]
+    boxes = np.bitwise_or.reduce(box_view(bits, size), axis=(2, 4))
+    return rows, cols, spread_boxes(boxes, size)
+
+
+def unit_cells(a, size):
+    '''The cells of each unit as (N, units, n) arrays: rows, cols, boxes'''
+    n = size * size
+    boxes = box_view(a, size).transpose(0, 1, 3, 2, 4).reshape(-1, n, n)
+    return a, a.transpose(0, 2, 1), boxes
+
+
+def to_bits(boards, n):
+    '''Value v as bit v - 1, and 0 for an empty cell'''
+    table = np.array([0] + [1 << v for v in range(n)], dtype=np.int32)
+    return table[np.clip(boards, 0, n)]
+
+
+def validate(boards):
+    '''(N,) bools, True where a board has values in range and no value
+       repeated in a row, col or box, as check_square'''
+    n = boards.shape[1]
+    size = sudoku.sudoku_size(boards[0])
+    in_range = ((boards >= 0) & (boards <= n)).all(axis=(1, 2))
+    bits = to_bits(boards, n)
+    ok = in_range
+    for unit in unit_cells(bits, size):
+        used = np.bitwise_or.reduce(unit, axis=2)
+        ok &= (popcount(used) == (unit != 0).sum(axis=2)).all(axis=1)
+    return ok
+
+
+def propagate_singles(boards):
+    '''Place naked and hidden singles on all boards at once, to a fixpoint
+
+       boards is changed in place.  Each round places every single found
+       on the board it started from; they are all forced, so if any of
+       them clash the board has no solution.  Candidates are bitmasks as
+       in Board, and each round only works on the boards that changed.
+       returns (N,) bools, True where a board is still valid
+    '''
+    n = boards.shape[1]
+    size = sudoku.sudoku_size(boards[0])
+    full = (1 << n) - 1
+    alive = validate(boards)
+    active = np.flatnonzero(alive)
+    while len(active):
+        sub = boards[active]
+        bits = to_bits(sub, n)
+        empty = sub == 0
+        rows, cols, boxes = unit_masks(bits, size)
+        cand = np.where(empty, full & ~(rows | cols | boxes), 0)
+
+        # Values with exactly one place in a unit, and a board is dead if
+        # a unit has a value that is neither placed nor possible
+        hidden = np.zeros_like(cand)
+        dead = (empty & (cand == 0)).any(axis=(1, 2))
+        spreads = (lambda s: s[:, :, None],
+                   lambda s: s[:, None, :],
+                   lambda s: spread_boxes(s, size))
+        for unit, unit_bits, spread in zip(
+                unit_cells(cand, size), unit_cells(bits, size), spreads):
+            once = np.zeros(unit.shape[:2], dtype=np.int32)
+            twice = np.zeros_like(once)
+            for j in range(n):
+                twice |= once & unit[:, :, j]
+                once |= unit[:, :, j]
+            used = np.bitwise_or.reduce(unit_bits, axis=2)
+            dead |= ((once | used) != full).any(axis=1)
+            hidden |= cand & spread(once & ~twice)
+
+        naked = popcount(cand) == 1
+        pick = np.where(naked, cand, hidden)
+        pick &= -pick
+        found = (pick != 0) & ~dead[:, None, None]
+        alive[active[dead]] = False
+        changed = found.any(axis=(1, 2))
+        if not changed.any():
+            break
+
+        values = np.log2(np.maximum(pick, 1)).astype(boards.dtype) + 1
+        sub[found] = values[found]
+        boards[active] = sub
+        active = active[changed]
+        alive[active] &= validate(boards[active])
+        active = active[alive[active]]
+    return alive
+
+
+def solve_same_size(puzzles, engine, tally):
+    '''solve_batch for puzzles all of the same size'''
+    boards = to_array(puzzles)
+    valid = validate(boards)
+    alive = propagate_singles(boards) & valid
+    filled = (boards != 0).all(axis=(1, 2))
+
+    solved = []
+    for puzzle, ok, good, full in zip(
+            from_array(boards), valid, alive, filled):
+        if not ok:
+            tally['invalid'] += 1
+            solved.append(None)
+        elif not good:
+            tally['unsolvable'] += 1
+            solved.append(None)
+        elif full:
+            tally['propagated'] += 1
+            solved.append(puzzle)
+        else:
+            tally['searched'] += 1
+            solved.append(sudoku.solve(puzzle, engine))
+    return solved
+
+
+def solve_batch(puzzles, engine='search', counts=None):
+    '''Solve puzzles, propagating singles on all of those of each size
+       at once and searching only those that are left open
+
+       returns a list of solved grids or None, as try_solve, in the
+       order of puzzles.  If counts is a dict, it gets the number of
+       puzzles that were invalid, found unsolvable by propagation,
+       solved by propagation and passed to the search.
+    '''
+    by_size = {}
+    for i, puzzle in enumerate(puzzles):
+        by_size.setdefault(len(puzzle), []).append(i)
+
+    solved = [None] * len(puzzles)
+    tally = {'invalid': 0, 'unsolvable': 0, 'propagated': 0, 'searched': 0}
+    for indices in by_size.values():
+        group = solve_same_size([puzzles[i] for i in indices], engine, tally)
+        for i, soln in zip(indices, group):
+            solved[i] = soln
+    if counts is not None:
+        counts.update(tally)
+    return solved
+
+
+if __name__ == '__main__':
+    engine = 'dlx' if '--dlx' in sys.argv else 'search'
+    lines = [line for line in sys.stdin if line.strip()]
+    puzzles = [sudoku.parse_line(line) for line in lines]
+    ok = [p for p in puzzles if p is not None]
+    counts = {}
+    solved = iter(solve_batch(ok, engine, counts) if ok else [])
+    for puzzle in puzzles:
+        soln = next(solved) if puzzle is not None else None
+        print(sudoku.format_line(soln) if soln else str(None))
+    print(f'invalid {counts.get("invalid", 0)}, '
+          f'unsolvable {counts.get("unsolvable", 0)}, '
+          f'propagated {counts.get("propagated", 0)}, '
+          f'searched {counts.get("searched", 0)}', file=sys.stderr)